@@ -0,0 +1,108 @@
+"""Helpers shared by the benchmarks: synthetic traffic decoded like the meshtastic library does."""
+
+import os
+import random
+import sys
+import time
+from decimal import Decimal
+
+import google.protobuf.json_format
+from meshtastic import BROADCAST_NUM, protocols
+from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+
+def decode_packet(mesh_packet):
+    """Build the packet dict that MeshInterface publishes on meshtastic.receive."""
+    as_dict = google.protobuf.json_format.MessageToDict(mesh_packet)
+    as_dict["raw"] = mesh_packet
+    as_dict.setdefault("from", 0)
+    as_dict.setdefault("to", 0)
+    if "decoded" in as_dict:
+        decoded = as_dict["decoded"]
+        decoded["payload"] = mesh_packet.decoded.payload
+        decoded.setdefault("portnum", "UNKNOWN_APP")
+        handler = protocols.get(mesh_packet.decoded.portnum)
+        if handler is not None and handler.protobufFactory is not None:
+            pb = handler.protobufFactory()
+            pb.ParseFromString(mesh_packet.decoded.payload)
+            p = google.protobuf.json_format.MessageToDict(pb)
+            if handler.name == "position":
+                if "latitudeI" in p:
+                    p["latitude"] = float(p["latitudeI"] * Decimal("1e-7"))
+                if "longitudeI" in p:
+                    p["longitude"] = float(p["longitudeI"] * Decimal("1e-7"))
+            decoded[handler.name] = p
+            p["raw"] = pb
+    return as_dict
+
+
+def mesh_packet(portnum, payload, sender, packet_id, hops=0):
+    packet = mesh_pb2.MeshPacket()
+    setattr(packet, "from", sender)
+    packet.to = BROADCAST_NUM
+    packet.id = packet_id
+    packet.rx_time = int(time.time())
+    packet.hop_start = 3
+    packet.hop_limit = 3 - hops
+    packet.rx_snr = random.uniform(-15, 10)
+    packet.rx_rssi = random.randint(-120, -40)
+    packet.decoded.portnum = portnum
+    packet.decoded.payload = (
+        payload if isinstance(payload, bytes) else payload.SerializeToString()
+    )
+    return packet
+
+
+def telemetry_payload():
+    payload = telemetry_pb2.Telemetry()
+    payload.time = int(time.time())
+    payload.device_metrics.battery_level = random.randint(1, 100)
+    payload.device_metrics.voltage = random.uniform(3.3, 4.2)
+    payload.device_metrics.channel_utilization = random.uniform(0, 30)
+    payload.device_metrics.air_util_tx = random.uniform(0, 5)
+    payload.device_metrics.uptime_seconds = random.randint(1, 1_000_000)
+    return payload
+
+
+def position_payload():
+    payload = mesh_pb2.Position()
+    payload.latitude_i = random.randint(-900_000_000, 900_000_000)
+    payload.longitude_i = random.randint(-1_800_000_000, 1_800_000_000)
+    payload.altitude = random.randint(0, 2000)
+    return payload
+
+
+def user_payload(num):
+    payload = mesh_pb2.User()
+    payload.id = f"!{num:08x}"
+    payload.long_name = f"Node {num:08x}"
+    payload.short_name = f"{num & 0xFFFF:04x}"
+    payload.macaddr = num.to_bytes(6, "big")
+    payload.hw_model = mesh_pb2.HardwareModel.RAK4631
+    return payload
+
+
+PAYLOADS = {
+    portnums_pb2.PortNum.TELEMETRY_APP: lambda num: telemetry_payload(),
+    portnums_pb2.PortNum.POSITION_APP: lambda num: position_payload(),
+    portnums_pb2.PortNum.NODEINFO_APP: user_payload,
+    portnums_pb2.PortNum.TEXT_MESSAGE_APP: lambda num: b"hello",
+}
+
+
+def synthetic_traffic(count, node_count=100, seed=1):
+    """Return a list of decoded packets with a mix of the portnums the exporter handles."""
+    random.seed(seed)
+    senders = [random.randint(1, 0xFFFFFFFE) for _ in range(node_count)]
+    portnums = list(PAYLOADS)
+    packets = []
+    for packet_id in range(1, count + 1):
+        sender = random.choice(senders)
+        portnum = random.choice(portnums)
+        raw = mesh_packet(
+            portnum, PAYLOADS[portnum](sender), sender, packet_id, random.randint(0, 3)
+        )
+        packets.append(decode_packet(raw))
+    return senders, packets
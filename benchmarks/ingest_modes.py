@@ -0,0 +1,79 @@
+"""Packets/sec of ingest reading the library's dicts vs. the MeshPacket protobuf.
+
+Three scenarios are measured on the same traffic:
+ - processing: the packet dict is already built, only the exporter's
+   processing is timed, the protobuf path gets the same packets,
+ - live: packets start as the MeshPackets the reader thread receives, the dict
+   path has the dicts built like the library does, the protobuf path hands
+   the MeshPacket straight to the exporter like install_lazy_decode does,
+ - recorded: like live, but starting from serialized MeshPackets as replay does.
+
+Usage: python benchmarks/ingest_modes.py [packets] [nodes]
+"""
+
+import sys
+import time
+
+from common import decode_packet, synthetic_traffic
+from meshtastic.protobuf import mesh_pb2
+
+import meshtastic_exporter as exporter
+
+
+def rate(packets, ingest):
+    start = time.perf_counter()
+    for packet in packets:
+        ingest(packet)
+    return len(packets) / (time.perf_counter() - start)
+
+
+def processing(packet):
+    exporter.process_packet(packet, None)
+
+
+def live_dict(mesh_packet):
+    exporter.process_packet(decode_packet(mesh_packet), None)
+
+
+def live_protobuf(mesh_packet):
+    exporter.process_packet(mesh_packet, None)
+
+
+def recorded_dict(serialized):
+    live_dict(mesh_pb2.MeshPacket.FromString(serialized))
+
+
+def recorded_protobuf(serialized):
+    live_protobuf(mesh_pb2.MeshPacket.FromString(serialized))
+
+
+def compare(name, packets, dict_ingest, protobuf_ingest):
+    exporter.ingest_protobuf = False
+    dict_rate = rate(packets, dict_ingest)
+    exporter.ingest_protobuf = True
+    protobuf_rate = rate(packets, protobuf_ingest)
+    label = f"{name},"
+    print(f"{label:11} dict:     {dict_rate:10.0f} packets/s")
+    print(
+        f"{label:11} protobuf: {protobuf_rate:10.0f} packets/s "
+        f"({protobuf_rate / dict_rate:.2f}x)"
+    )
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    node_count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    _, packets = synthetic_traffic(count, node_count)
+    mesh_packets = [packet["raw"] for packet in packets]
+    recording = [mesh_packet.SerializeToString() for mesh_packet in mesh_packets]
+    # every packet is processed several times, so de-duplication must be off
+    exporter.dedup.window = 0
+    rate(packets, processing)
+    print(f"packets: {count}, nodes: {node_count}")
+    compare("processing", packets, processing, processing)
+    compare("live", mesh_packets, live_dict, live_protobuf)
+    compare("recorded", recording, recorded_dict, recorded_protobuf)
+
+
+if __name__ == "__main__":
+    main()
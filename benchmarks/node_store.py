@@ -0,0 +1,113 @@
+"""Ingest throughput and memory per node: one Gauge per family vs. the node store.
+
+Usage: python benchmarks/node_store.py [packets] [nodes]
+"""
+
+import gc
+import sys
+import time
+import tracemalloc
+
+from prometheus_client import CollectorRegistry, Gauge, generate_latest
+
+from common import synthetic_traffic
+
+import meshtastic_exporter as exporter
+
+
+class GaugeFamilies:
+    """The per-node metrics as they were before the node store, one Gauge per family."""
+
+    def __init__(self):
+        registry = self.registry = CollectorRegistry()
+        self.hop_limit = Gauge("node_hop_limit", "", ["num"], registry=registry)
+        self.hop_count = Gauge("node_hop_count", "", ["num"], registry=registry)
+        self.snr = Gauge("node_snr", "", ["num"], registry=registry)
+        self.rssi = Gauge("node_rssi", "", ["num"], registry=registry)
+        self.latitude = Gauge("node_latitude", "", ["num"], registry=registry)
+        self.longitude = Gauge("node_longitude", "", ["num"], registry=registry)
+        self.altitude = Gauge("node_altitude", "", ["num"], registry=registry)
+        self.device_metrics = Gauge(
+            "device_metric", "", ["num", "metric", "type"], registry=registry
+        )
+
+    def ingest(self, packet):
+        sender = packet["from"]
+        raw_data = packet["raw"]
+        if raw_data.hop_start:
+            self.hop_limit.labels(num=sender).set(raw_data.hop_start)
+        if raw_data.hop_limit and raw_data.hop_start:
+            hops = raw_data.hop_start - raw_data.hop_limit
+            self.hop_count.labels(num=sender).set(hops)
+            if hops == 0:
+                if raw_data.rx_snr:
+                    self.snr.labels(num=sender).set(raw_data.rx_snr)
+                if raw_data.rx_rssi:
+                    self.rssi.labels(num=sender).set(raw_data.rx_rssi)
+        portnum = packet["decoded"]["portnum"]
+        if portnum == "POSITION_APP":
+            position = packet["decoded"]["position"]
+            self.latitude.labels(num=sender).set(position["latitude"])
+            self.longitude.labels(num=sender).set(position["longitude"])
+            self.altitude.labels(num=sender).set(position["altitude"])
+        elif portnum == "TELEMETRY_APP":
+            telemetry = packet["decoded"]["telemetry"]
+            for key, value in telemetry["deviceMetrics"].items():
+                self.device_metrics.labels(num=sender, metric=key, type="device").set(
+                    value
+                )
+
+
+def store_ingest(packet):
+    sender = packet["from"]
+    exporter.parse_signal_and_hops(packet["raw"], sender)
+    portnum = packet["decoded"]["portnum"]
+    if portnum == "POSITION_APP":
+        exporter.parse_position_packet(packet, sender)
+    elif portnum == "TELEMETRY_APP":
+        exporter.parse_telemetry_packet(packet, sender)
+
+
+def throughput(packets, ingest):
+    start = time.perf_counter()
+    for packet in packets:
+        ingest(packet)
+    return len(packets) / (time.perf_counter() - start)
+
+
+def retained_bytes(packets, ingest):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    for packet in packets:
+        ingest(packet)
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return after - before
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+    node_count = int(sys.argv[2]) if len(sys.argv) > 2 else 300
+    _, packets = synthetic_traffic(count, node_count)
+    families = GaugeFamilies()
+    gauge_memory = retained_bytes(packets, families.ingest)
+    store_memory = retained_bytes(packets, store_ingest)
+    gauge_rate = throughput(packets, families.ingest)
+    store_rate = throughput(packets, store_ingest)
+    print(f"packets: {count}, nodes: {node_count}")
+    print(
+        f"gauge families: {gauge_rate:10.0f} packets/s, "
+        f"{gauge_memory / node_count:8.0f} B/node, "
+        f"{len(generate_latest(families.registry))} B exposition"
+    )
+    print(
+        f"node store:     {store_rate:10.0f} packets/s, "
+        f"{store_memory / node_count:8.0f} B/node, "
+        f"{len(generate_latest(exporter.REGISTRY))} B exposition"
+    )
+
+
+if __name__ == "__main__":
+    main()
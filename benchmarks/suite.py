@@ -0,0 +1,180 @@
+"""Benchmark suite covering ingest, exposition, memory and startup, written as JSON.
+
+Every scenario that depends on the number of nodes runs in a fresh process, so
+the results do not depend on the order they ran in. Compare two result files
+to see whether a change makes the exporter fall behind a busy mesh.
+
+Usage: python benchmarks/suite.py [output.json] [packets per portnum]
+"""
+
+import gc
+import gzip
+import json
+import os
+import platform
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+from common import PAYLOADS, decode_packet, mesh_packet, synthetic_traffic
+from meshtastic.protobuf import portnums_pb2
+from prometheus_client import generate_latest
+
+import meshtastic_exporter as exporter
+
+NODE_COUNTS = (100, 1_000, 10_000)
+EXPORTER = os.path.join(os.path.dirname(__file__), "..", "meshtastic_exporter.py")
+
+
+def ingest_per_portnum(count):
+    """packets/s from on_receive until the ingest workers are done, per portnum"""
+    exporter.ingest.start(exporter.ingest_workers, exporter.process_packet)
+    exporter.ingest.policy = exporter.DropPolicy.block
+    senders, _ = synthetic_traffic(0, 300)
+    results = {}
+    packet_id = 0
+    for portnum, payload in PAYLOADS.items():
+        packets = []
+        for i in range(count):
+            sender = senders[i % len(senders)]
+            packet_id += 1
+            packets.append(
+                decode_packet(mesh_packet(portnum, payload(sender), sender, packet_id))
+            )
+        start = time.perf_counter()
+        for packet in packets:
+            exporter.on_receive(packet, None)
+        exporter.ingest.join()
+        name = portnums_pb2.PortNum.Name(portnum)
+        results[name] = count / (time.perf_counter() - start)
+    return results
+
+
+def set_last_heard_scaling():
+    """microseconds per set_last_heard call adding new nodes and updating known ones"""
+    nodeinfo = portnums_pb2.PortNum.NODEINFO_APP
+    users = {
+        num: decode_packet(mesh_packet(nodeinfo, PAYLOADS[nodeinfo](num), num, num))[
+            "decoded"
+        ]["user"]
+        for num in range(1, max(NODE_COUNTS) + 1)
+    }
+    results = {}
+    for node_count in NODE_COUNTS:
+        exporter.store.nodes.clear()
+        start = time.perf_counter()
+        for num in range(1, node_count + 1):
+            exporter.set_last_heard(num, users[num], time.time())
+        added = time.perf_counter() - start
+        start = time.perf_counter()
+        for num in range(1, node_count + 1):
+            exporter.set_last_heard(num, users[num], time.time())
+        updated = time.perf_counter() - start
+        results[node_count] = {
+            "add_us": added / node_count * 1e6,
+            "update_us": updated / node_count * 1e6,
+        }
+    return results
+
+
+def resident_bytes():
+    with open("/proc/self/statm") as statm:
+        return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def node_state(node_count):
+    """render time, exposition size and resident memory with node_count busy nodes"""
+    # one packet of every handled portnum per node
+    packets = [
+        decode_packet(mesh_packet(portnum, payload(num), num, num * 8 + index))
+        for num in range(1, node_count + 1)
+        for index, (portnum, payload) in enumerate(PAYLOADS.items())
+    ]
+    gc.collect()
+    before = resident_bytes()
+    for packet in packets:
+        exporter.process_packet(packet, None)
+    gc.collect()
+    after = resident_bytes()
+    renders = []
+    for _ in range(5):
+        start = time.perf_counter()
+        body = generate_latest(exporter.REGISTRY)
+        renders.append(time.perf_counter() - start)
+    return {
+        "render_seconds": min(renders),
+        "exposition_bytes": len(body),
+        "exposition_gzip_bytes": len(gzip.compress(body)),
+        "rss_bytes_per_node": (after - before) / node_count,
+    }
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def startup(node_count):
+    """seconds from starting a simulated exporter to the first scrape with all nodes"""
+    port = free_port()
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        [sys.executable, EXPORTER, "--log-level", "warning", "simulate"]
+        + ["--nodes", str(node_count), "--rate", "1", "--port", str(port)],
+    )
+    try:
+        while process.poll() is None:
+            try:
+                with urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics") as page:
+                    if page.read().count(b"\nnode_info{") >= node_count:
+                        return time.perf_counter() - start
+            except OSError:
+                pass
+            time.sleep(0.01)
+        raise RuntimeError(f"exporter exited with {process.returncode}")
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def in_subprocess(scenario, node_count):
+    output = subprocess.run(
+        [sys.executable, __file__, scenario, str(node_count)],
+        check=True,
+        capture_output=True,
+    ).stdout
+    return json.loads(output)
+
+
+def main():
+    if len(sys.argv) == 3 and sys.argv[1] == "node-state":
+        json.dump(node_state(int(sys.argv[2])), sys.stdout)
+        return
+    output = sys.argv[1] if len(sys.argv) > 1 else "benchmark.json"
+    count = int(sys.argv[2]) if len(sys.argv) > 2 else 20_000
+    # the same packets are sent to several scenarios
+    exporter.dedup.window = 0
+    results = {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "ingest_packets_per_second": ingest_per_portnum(count),
+        "set_last_heard": set_last_heard_scaling(),
+        "node_state": {
+            node_count: in_subprocess("node-state", node_count)
+            for node_count in NODE_COUNTS
+        },
+        "startup_seconds": {
+            node_count: startup(node_count) for node_count in NODE_COUNTS
+        },
+    }
+    with open(output, "w") as file:
+        json.dump(results, file, indent=2)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,90 +1,1746 @@
+import asyncio
+import atexit
+import base64
+import bisect
+import collections
+import functools
+import gzip
+import heapq
+import itertools
+import json
+import logging
+import logging.handlers
+import marshal
+import math
+import mmap
+import os
+import queue
+import random
+import signal
+import socket
+import statistics
+import struct
 import sys
+import threading
 import time
-from typing import Optional
+import weakref
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from enum import Enum
+from http import HTTPStatus
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Annotated, List, Optional
 
 import meshtastic
 import meshtastic.ble_interface
 import meshtastic.serial_interface
 import meshtastic.tcp_interface
 import typer
-from meshtastic import BROADCAST_NUM
+from google.protobuf.descriptor import FieldDescriptor
+from google.protobuf.json_format import MessageToDict
+from google.protobuf.message import Message
+from meshtastic import BROADCAST_NUM, LOCAL_ADDR, protocols
 from meshtastic.mesh_interface import MeshInterface
-from prometheus_client import start_http_server, Gauge, Counter
+from meshtastic.protobuf import admin_pb2, mesh_pb2, portnums_pb2, telemetry_pb2
+from prometheus_client import REGISTRY, Gauge, Counter, Histogram, Summary
+from prometheus_client.core import CounterMetricFamily, GaugeMetricFamily
+from prometheus_client.exposition import choose_encoder, gzip_accepted
+from prometheus_client.samples import Exemplar
 from pubsub import pub
 
 INCOMING_MESSAGES = Counter(
     "incoming_messages", "Number of messages received by the radio.", ["type"]
 )
-NODE_INFO = Gauge(
-    "node_info",
-    "Basic information about the nodes. Value is the last seen timestamp.",
-    ["num", "id", "long_name", "short_name", "macaddr", "hw_model", "is_licensed"],
+INGEST_ENQUEUED = Counter(
+    "ingest_enqueued", "Number of packets handed over to the ingest queue."
 )
-NODE_LATITUDE = Gauge(
-    "node_latitude", "Latitude of the node, if it exposes position.", ["num"]
+JOURNAL_DROPPED = Counter(
+    "journal_dropped_records",
+    "Number of packets not recorded because the journal writer fell behind.",
 )
-NODE_LONGITUDE = Gauge(
-    "node_longitude", "Longitude of the node, if it exposes position.", ["num"]
+INGEST_DROPPED = Counter(
+    "ingest_dropped",
+    "Number of packets dropped because the ingest queue was full.",
+    ["policy"],
 )
-NODE_ALTITUDE = Gauge(
-    "node_altitude", "Altitude of the node, if it exposes position.", ["num"]
+INGEST_QUEUE_DEPTH = Gauge(
+    "ingest_queue_depth", "Number of packets waiting in the ingest queue."
 )
-NODE_SNR = Gauge(
-    "node_snr",
-    "Signal to noise ratio for messages received directly from the node",
-    ["num"],
+HANDLER_INVOCATIONS = Counter(
+    "handler_invocations",
+    "Number of times a packet handler was invoked.",
+    ["handler", "type"],
 )
-NODE_RSSI = Gauge(
-    "node_rssi", "RSSI for messages received directly from the node", ["num"]
+HANDLER_SECONDS = Counter(
+    "handler_seconds",
+    "Cumulative time spent in a packet handler.",
+    ["handler", "type"],
 )
-NODE_HOP_LIMIT = Gauge(
-    "node_hop_limit", "Hop limit of messages sent by the node", ["num"]
+HANDLER_ERRORS = Counter(
+    "handler_errors",
+    "Number of exceptions raised by a packet handler.",
+    ["handler", "type"],
 )
-NODE_HOP_COUNT = Gauge("node_hop_count", "How many hops from the node we are", ["num"])
-DEVICE_METRICS = Gauge(
-    "device_metric",
-    "Metric exposed by the device, together with its value.",
-    ["num", "metric", "type"],
+PACKET_PROCESSING_SECONDS = Histogram(
+    "packet_processing_seconds",
+    "Time spent updating the metrics from a single packet.",
+    ["type"],
+    buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3, 2.5e-3, 1e-2, 0.1, 1),
 )
-MESSAGES = Counter(
-    "message_count", "Messages sent between nodes", ["src", "dest", "type"]
+PACKET_LAG_SECONDS = Histogram(
+    "packet_lag_seconds",
+    "Time between the radio receiving a packet and the exporter processing it, to the second of the radio's rx_time.",
+    buckets=(1, 2, 5, 10, 30, 60, 300),
 )
+LAST_PACKET_TIMESTAMP = Gauge(
+    "last_packet_timestamp_seconds", "When the last packet was received."
+)
+RADIO_UP = Gauge("radio_up", "Whether the radio is connected.", ["radio"])
+RADIO_RECONNECTS = Counter(
+    "radio_reconnects",
+    "Number of times the connection to the radio was re-established.",
+    ["radio"],
+)
+RADIO_LAST_RECONNECT = Gauge(
+    "radio_last_reconnect_timestamp_seconds",
+    "When the connection to the radio was last re-established.",
+    ["radio"],
+)
+STARTUP_PHASE_SECONDS = Gauge(
+    "startup_phase_seconds",
+    "Duration of the phases of the last connection to the radio: connect, config download and node seeding.",
+    ["radio", "phase"],
+)
+RADIO_SILENCE = Gauge(
+    "radio_silence_seconds",
+    "Time since the radio delivered the last packet.",
+    ["radio"],
+)
+RADIO_EXPECTED_SILENCE = Gauge(
+    "radio_expected_silence_seconds",
+    "Longest silence the liveness watchdog accepts before probing the radio.",
+    ["radio"],
+)
+EXPOSITION_CACHE_HITS = Counter(
+    "exposition_cache_hits", "Number of scrapes served from the cached exposition."
+)
+EXPOSITION_CACHE_MISSES = Counter(
+    "exposition_cache_misses", "Number of scrapes that had to render the exposition."
+)
+EXPOSITION_RENDER_SECONDS = Summary(
+    "exposition_render_seconds", "Time spent rendering the exposition."
+)
+DUPLICATE_PACKETS = Counter(
+    "duplicate_packets",
+    "Number of rebroadcast copies of already processed packets.",
+    ["type"],
+)
+MERGED_PACKETS = Counter(
+    "merged_packets",
+    "Number of copies of already counted packets whose signal was recorded for another radio.",
+    ["radio"],
+)
+SKIPPED_DECODES = Counter(
+    "skipped_decodes",
+    "Number of packets counted from their envelope only, without decoding the payload.",
+    ["type"],
+)
+NODE_RENAMES = Counter(
+    "node_renames",
+    "Number of times a node changed its name, hardware model or other node_info labels.",
+)
+NODES_EXPIRED = Counter(
+    "nodes_expired", "Number of nodes removed because they were not heard recently."
+)
+LOG_RECORDS_DROPPED = Counter(
+    "log_records_dropped",
+    "Number of log records dropped because the async log queue was full.",
+)
+SNAPSHOT_SECONDS = Summary("snapshot_seconds", "Time spent writing state snapshots.")
+SNAPSHOT_BYTES = Gauge("snapshot_bytes", "Size of the last written state snapshot.")
+
+logger = logging.getLogger("meshtastic_exporter")
+# the packet log is configured separately, it is off unless sampling is enabled
+packet_logger = logging.getLogger("meshtastic_exporter.packets")
+packet_logger.propagate = False
 
 # latest node information in a dict form digestible for scripts and correlation
 nodes = {}
 
+
+class NodeState:
+    """Everything exported about a single node, rendered by NodeCollector at scrape time.
+
+    Fields that were never received stay None and their series are not exported.
+    """
+
+    __slots__ = (
+        "num",
+        "user",
+        "last_heard",
+        "hop_limit",
+        "signal",
+        "latitude",
+        "longitude",
+        "altitude",
+        "telemetry",
+        "sent",
+        "hop_limit_time",
+        "position_time",
+        "telemetry_times",
+        "sent_packets",
+        "seen",
+    )
+
+    def __init__(self, num):
+        self.num = num
+        # node_info label values, in NODE_INFO_LABELS order minus the num
+        self.user = None
+        self.last_heard = None
+        # local time of the last counted packet, encrypted ones included, see expire
+        self.seen = None
+        self.hop_limit = None
+        # radio -> [hop_count, snr, rssi, hop count receive time, snr/rssi receive time],
+        # radio is "" unless several radios are connected. The values are None until
+        # received, snr and rssi only come from direct messages.
+        self.signal = {}
+        self.latitude = None
+        self.longitude = None
+        self.altitude = None
+        # (metric, type) -> value
+        self.telemetry = {}
+        # (dest, type) -> number of messages sent by this node
+        self.sent = {}
+        # radio receive times of the packets the values above were taken from,
+        # None when the radio did not stamp the packet
+        self.hop_limit_time = None
+        self.position_time = None
+        # type -> receive time of the last telemetry packet of that type
+        self.telemetry_times = {}
+        # (dest, type) -> (id, receive time) of the last message, for exemplars
+        self.sent_packets = {}
+
+
+class TopMessagePairs:
+    """Space-Saving heavy hitter tracking of the busiest src/dest pairs.
+
+    At most k pairs are tracked. A pair that is not tracked takes over the
+    slot of the pair with the lowest estimate, whose exact counts are folded
+    into the "other" bucket, so the exported counters never go down and the
+    total over all series stays exact. Memory is fixed by k.
+    """
+
+    def __init__(self, k: int):
+        self.k = k
+        # (src, dest) -> [estimate, {type: count since tracked}, {type: (id, rx time)}]
+        self.pairs = {}
+        # min-heap of (estimate, sequence, pair) with exactly one entry per
+        # tracked pair, entries are refreshed lazily when they come up for
+        # eviction. The sequence breaks ties, so pairs with an int dest and
+        # with "all" are never compared.
+        self._heap = []
+        self._sequence = itertools.count()
+        # type -> count of messages of pairs that are no longer tracked
+        self.other = {}
+
+    def count(self, src, dest, message_type, last_packet=None):
+        pair = (src, dest)
+        entry = self.pairs.get(pair)
+        if entry is None:
+            estimate = 0
+            if len(self.pairs) >= self.k:
+                estimate = self._evict()
+            entry = self.pairs[pair] = [estimate, {}, {}]
+            heapq.heappush(self._heap, (estimate, next(self._sequence), pair))
+        entry[0] += 1
+        counts = entry[1]
+        counts[message_type] = counts.get(message_type, 0) + 1
+        if last_packet is not None:
+            entry[2][message_type] = last_packet
+
+    def _evict(self):
+        while True:
+            estimate, _, pair = heapq.heappop(self._heap)
+            entry = self.pairs.get(pair)
+            if entry is None:
+                continue
+            if entry[0] != estimate:
+                heapq.heappush(self._heap, (entry[0], next(self._sequence), pair))
+                continue
+            del self.pairs[pair]
+            self._fold(entry[1])
+            return estimate
+
+    def _fold(self, counts):
+        for message_type, count in counts.items():
+            self.other[message_type] = self.other.get(message_type, 0) + count
+
+    def restore(self, pairs, other):
+        self.pairs = {pair: list(entry) for pair, entry in pairs.items()}
+        self.other = dict(other)
+        self._rebuild_heap()
+        # the snapshot may come from a run with a larger k
+        while len(self.pairs) > self.k:
+            self._evict()
+
+    def remove_node(self, num):
+        """forgets the pairs a node is part of, their heap entries are skipped later"""
+        for pair in [pair for pair in self.pairs if num in pair]:
+            del self.pairs[pair]
+        if len(self._heap) > 2 * self.k:
+            self._rebuild_heap()
+
+    def _rebuild_heap(self):
+        self._heap = [
+            (entry[0], next(self._sequence), pair) for pair, entry in self.pairs.items()
+        ]
+        heapq.heapify(self._heap)
+
+
+class NodeStore:
+    def __init__(self):
+        self.nodes = {}
+        # bumped after every change, lets the exposition cache know it is stale
+        self.generation = 0
+        # seconds after the last heard time a node is removed, 0 keeps nodes forever
+        self.ttl = 0
+        # min-heap of (deadline, num), at most one entry per node. Deadlines are
+        # only checked when they come due, a node heard since then is pushed back.
+        self._deadlines = []
+        # dest -> senders having a message_count series towards that dest
+        self._inbound = collections.defaultdict(set)
+        # when set, message_count is limited to the top pairs instead of NodeState.sent
+        self.top_messages: Optional[TopMessagePairs] = None
+        # render samples with their receive time and message counters with exemplars
+        self.timestamps = False
+        # several radios are connected, signal series get a radio label
+        self.radio_label = False
+        self._lock = threading.Lock()
+
+    def changed(self):
+        self.generation += 1
+
+    def node(self, num) -> NodeState:
+        state = self.nodes.get(num)
+        if state is None:
+            with self._lock:
+                state = self.nodes.get(num)
+                if state is None:
+                    state = self.nodes[num] = NodeState(num)
+                    if self.ttl:
+                        heapq.heappush(self._deadlines, (time.time() + self.ttl, num))
+        return state
+
+    def count_message(self, src, dest, message_type, last_packet=None):
+        """last_packet is the (id, receive time) of the message, kept for exemplars"""
+        if self.top_messages is not None:
+            with self._lock:
+                self.top_messages.count(src, dest, message_type, last_packet)
+            return
+        node = self.node(src)
+        sent = node.sent
+        key = (dest, message_type)
+        with self._lock:
+            count = sent.get(key)
+            if count is None:
+                self._inbound[dest].add(src)
+                count = 0
+            sent[key] = count + 1
+            if last_packet is not None:
+                node.sent_packets[key] = last_packet
+
+    def dump(self):
+        """plain data copy of the store, restored with load"""
+        with self._lock:
+            state = {
+                "fields": NodeState.__slots__,
+                "nodes": [
+                    tuple(getattr(node, field) for field in NodeState.__slots__)
+                    for node in list(self.nodes.values())
+                ],
+            }
+            if self.top_messages is not None:
+                state["top_messages"] = (
+                    self.top_messages.pairs,
+                    self.top_messages.other,
+                )
+            # marshalled while holding the lock, the dicts must not change meanwhile
+            return marshal.dumps(state)
+
+    def load(self, data: bytes):
+        state = marshal.loads(data)
+        fields = [
+            field if field in NodeState.__slots__ else None for field in state["fields"]
+        ]
+        now = time.time()
+        with self._lock:
+            for values in state["nodes"]:
+                node = NodeState(values[0])
+                for field, value in zip(fields, values):
+                    if field is not None:
+                        setattr(node, field, value)
+                if self.top_messages is not None:
+                    # counted by the top pairs from now on
+                    node.sent = {}
+                    node.sent_packets = {}
+                self.nodes[node.num] = node
+                for dest, _ in node.sent:
+                    self._inbound[dest].add(node.num)
+                if self.ttl:
+                    heapq.heappush(self._deadlines, (now + self.ttl, node.num))
+            if self.top_messages is not None and "top_messages" in state:
+                self.top_messages.restore(*state["top_messages"])
+        self.changed()
+
+    def expire(self, now: float):
+        """removes all nodes not heard for ttl seconds, returns their numbers
+
+        A node is heard with any packet it sends, one that only sends encrypted
+        packets never gets a last_heard.
+        """
+        expired = []
+        with self._lock:
+            while self._deadlines and self._deadlines[0][0] <= now:
+                _, num = heapq.heappop(self._deadlines)
+                node = self.nodes.get(num)
+                if node is None:
+                    continue
+                deadline = float(node.seen or node.last_heard or 0) + self.ttl
+                if deadline > now:
+                    heapq.heappush(self._deadlines, (deadline, num))
+                    continue
+                self._remove(node)
+                expired.append(num)
+        return expired
+
+    def _remove(self, node: NodeState):
+        del self.nodes[node.num]
+        if self.top_messages is not None:
+            self.top_messages.remove_node(node.num)
+        for dest, _ in node.sent:
+            senders = self._inbound.get(dest)
+            if senders is not None:
+                senders.discard(node.num)
+                if not senders:
+                    del self._inbound[dest]
+        for src in self._inbound.pop(node.num, ()):
+            sender = self.nodes.get(src)
+            if sender is not None:
+                for key in [key for key in sender.sent if key[0] == node.num]:
+                    del sender.sent[key]
+                    sender.sent_packets.pop(key, None)
+
+
+store = NodeStore()
+
+
+class Snapshot:
+    """Periodic dump of the exporter state to a local file, loaded on startup.
+
+    The file is a zlib compressed marshal of the node store and the incoming
+    message counters. It is written to a temporary file first and renamed over
+    the previous snapshot, so a crash never leaves a partial snapshot behind.
+    """
+
+    MAGIC = b"MXS1"
+
+    def __init__(self, path: str, interval: float = 60):
+        self.path = path
+        self.interval = interval
+
+    def save(self):
+        with SNAPSHOT_SECONDS.time():
+            incoming = {
+                sample.labels["type"]: sample.value
+                for metric in INCOMING_MESSAGES.collect()
+                for sample in metric.samples
+                if sample.name.endswith("_total")
+            }
+            data = self.MAGIC + zlib.compress(
+                marshal.dumps((store.dump(), incoming)), 1
+            )
+            temporary = self.path + ".tmp"
+            with open(temporary, "wb") as file:
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(temporary, self.path)
+        SNAPSHOT_BYTES.set(len(data))
+
+    def load(self) -> bool:
+        try:
+            with open(self.path, "rb") as file:
+                data = file.read()
+        except FileNotFoundError:
+            return False
+        if not data.startswith(self.MAGIC):
+            logger.warning("Ignoring snapshot %s in an unknown format", self.path)
+            return False
+        try:
+            nodes_state, incoming = marshal.loads(
+                zlib.decompress(data[len(self.MAGIC) :])
+            )
+            store.load(nodes_state)
+        except (ValueError, EOFError, TypeError, KeyError, zlib.error) as ex:
+            logger.warning("Ignoring unreadable snapshot %s: %s", self.path, ex)
+            return False
+        for message_type, value in incoming.items():
+            INCOMING_MESSAGES.labels(type=message_type).inc(value)
+        logger.info("Loaded %d nodes from snapshot %s", len(store.nodes), self.path)
+        return True
+
+    def save_forever(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.save()
+            except OSError as ex:
+                logger.warning("Could not write snapshot %s: %s", self.path, ex)
+
+
+state_snapshot: Optional[Snapshot] = None
+
+NODE_INFO_LABELS = [
+    "num",
+    "id",
+    "long_name",
+    "short_name",
+    "macaddr",
+    "hw_model",
+    "is_licensed",
+]
+
+
+def packet_exemplar(last_packet):
+    if last_packet is None:
+        return None
+    packet_id, rx_time = last_packet
+    return Exemplar({"packet_id": str(packet_id)}, 1, rx_time)
+
+
+def best_radio(signal):
+    """the radio with the fewest hops to a node, ties go to the better SNR"""
+    best = None
+    best_key = None
+    for radio, (hops, snr, *_) in signal.items():
+        if hops is None:
+            continue
+        key = (hops, -snr if snr is not None else math.inf)
+        if best_key is None or key < best_key:
+            best, best_key = radio, key
+    return best
+
+
+class NodeCollector:
+    """Renders the per-node metric families from the node store."""
+
+    def __init__(self, node_store: NodeStore):
+        self.store = node_store
+
+    def describe(self):
+        return []
+
+    def collect(self):
+        info = GaugeMetricFamily(
+            "node_info",
+            "Basic information about the nodes. Value is the last seen timestamp.",
+            labels=NODE_INFO_LABELS,
+        )
+        latitude = GaugeMetricFamily(
+            "node_latitude",
+            "Latitude of the node, if it exposes position.",
+            labels=["num"],
+        )
+        longitude = GaugeMetricFamily(
+            "node_longitude",
+            "Longitude of the node, if it exposes position.",
+            labels=["num"],
+        )
+        altitude = GaugeMetricFamily(
+            "node_altitude",
+            "Altitude of the node, if it exposes position.",
+            labels=["num"],
+        )
+        signal_labels = ["num", "radio"] if self.store.radio_label else ["num"]
+        snr = GaugeMetricFamily(
+            "node_snr",
+            "Signal to noise ratio for messages received directly from the node",
+            labels=signal_labels,
+        )
+        rssi = GaugeMetricFamily(
+            "node_rssi",
+            "RSSI for messages received directly from the node",
+            labels=signal_labels,
+        )
+        hop_limit = GaugeMetricFamily(
+            "node_hop_limit", "Hop limit of messages sent by the node", labels=["num"]
+        )
+        hop_count = GaugeMetricFamily(
+            "node_hop_count",
+            "How many hops from the node we are",
+            labels=signal_labels,
+        )
+        best_path = GaugeMetricFamily(
+            "node_best_path",
+            "Fewest hops to the node over all radios, radio is the radio on that path",
+            labels=["num", "radio"],
+        )
+        device_metrics = GaugeMetricFamily(
+            "device_metric",
+            "Metric exposed by the device, together with its value.",
+            labels=["num", "metric", "type"],
+        )
+        messages = CounterMetricFamily(
+            "message_count",
+            "Messages sent between nodes",
+            labels=["src", "dest", "type"],
+        )
+        timestamps = self.store.timestamps
+        radio_label = self.store.radio_label
+        for node in list(self.store.nodes.values()):
+            num = str(node.num)
+            if node.user is not None:
+                last_heard = float(node.last_heard or 0)
+                info.add_metric(
+                    (num, *node.user),
+                    last_heard,
+                    (last_heard or None) if timestamps else None,
+                )
+            position_time = node.position_time if timestamps else None
+            if node.latitude is not None:
+                latitude.add_metric((num,), node.latitude, position_time)
+            if node.longitude is not None:
+                longitude.add_metric((num,), node.longitude, position_time)
+            if node.altitude is not None:
+                altitude.add_metric((num,), node.altitude, position_time)
+            if node.hop_limit is not None:
+                hop_limit.add_metric(
+                    (num,), node.hop_limit, node.hop_limit_time if timestamps else None
+                )
+            for radio, (hops, node_snr, node_rssi, hops_time, direct_time) in list(
+                node.signal.items()
+            ):
+                labels = (num, radio) if radio_label else (num,)
+                if not timestamps:
+                    hops_time = direct_time = None
+                if hops is not None:
+                    hop_count.add_metric(labels, hops, hops_time)
+                if node_snr is not None:
+                    snr.add_metric(labels, node_snr, direct_time)
+                if node_rssi is not None:
+                    rssi.add_metric(labels, node_rssi, direct_time)
+            if radio_label:
+                best = best_radio(node.signal)
+                if best is not None:
+                    best_path.add_metric((num, best), node.signal[best][0])
+            telemetry_times = node.telemetry_times if timestamps else {}
+            for (metric, metric_type), value in list(node.telemetry.items()):
+                device_metrics.add_metric(
+                    (num, metric, metric_type),
+                    value,
+                    telemetry_times.get(metric_type),
+                )
+            sent_packets = node.sent_packets
+            for key, count in list(node.sent.items()):
+                messages.add_metric(
+                    (num, str(key[0]), key[1]),
+                    count,
+                    exemplar=packet_exemplar(sent_packets.get(key)),
+                )
+        top_messages = self.store.top_messages
+        if top_messages is not None:
+            for (src, dest), (_, counts, packets) in list(top_messages.pairs.items()):
+                for message_type, count in list(counts.items()):
+                    messages.add_metric(
+                        (str(src), str(dest), message_type),
+                        count,
+                        exemplar=packet_exemplar(packets.get(message_type)),
+                    )
+            for message_type, count in list(top_messages.other.items()):
+                messages.add_metric(("other", "other", message_type), count)
+        yield info
+        yield latitude
+        yield longitude
+        yield altitude
+        yield snr
+        yield rssi
+        yield hop_limit
+        yield hop_count
+        if radio_label:
+            yield best_path
+        yield device_metrics
+        yield messages
+
+
+REGISTRY.register(NodeCollector(store))
+
+
+class RenderedBody:
+    __slots__ = ("generation", "rendered_at", "modified", "etag", "body", "gzipped")
+
+    def __init__(self, generation, rendered_at, body):
+        self.generation = generation
+        self.rendered_at = rendered_at
+        self.modified = time.time()
+        self.etag = f'"{generation:x}-{int(self.modified * 1000):x}"'
+        self.body = body
+        self.gzipped = None
+
+
+OPENMETRICS_ACCEPT = "application/openmetrics-text; version=1.0.0"
+
+
+class ExpositionCache:
+    """Last rendered exposition per content type, re-rendered only when dirty.
+
+    A body is dirty once the store generation moved since it was rendered, or
+    once it is older than max_age so the exporter's own metrics keep moving on
+    a quiet mesh. The gzipped body is compressed once per render.
+    """
+
+    def __init__(self, registry, node_store: NodeStore, max_age: float = 60):
+        self.registry = registry
+        self.store = node_store
+        self.max_age = max_age
+        # serve OpenMetrics whatever the client asked for
+        self.openmetrics = False
+        self._bodies = {}
+        self._lock = threading.Lock()
+
+    def get(self, accept_header, compress: bool):
+        """returns the content type, body, etag and modification time for the Accept header"""
+        if self.openmetrics:
+            accept_header = OPENMETRICS_ACCEPT
+        encoder, content_type = choose_encoder(accept_header)
+        with self._lock:
+            rendered = self._bodies.get(content_type)
+            generation = self.store.generation
+            now = time.monotonic()
+            if (
+                rendered is None
+                or rendered.generation != generation
+                or now - rendered.rendered_at > self.max_age
+            ):
+                EXPOSITION_CACHE_MISSES.inc()
+                with EXPOSITION_RENDER_SECONDS.time():
+                    rendered = RenderedBody(generation, now, encoder(self.registry))
+                self._bodies[content_type] = rendered
+            else:
+                EXPOSITION_CACHE_HITS.inc()
+            if not compress:
+                return content_type, rendered.body, rendered.etag, rendered.modified
+            if rendered.gzipped is None:
+                rendered.gzipped = gzip.compress(rendered.body)
+            etag = rendered.etag[:-1] + '-gzip"'
+            return content_type, rendered.gzipped, etag, rendered.modified
+
+
+exposition = ExpositionCache(REGISTRY, store)
+
+
+def not_modified(headers, etag: str, modified: float) -> bool:
+    if_none_match = headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = headers.get("if-modified-since")
+    if if_modified_since is not None:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+HEALTHY_PATH = "/-/healthy"
+READY_PATH = "/-/ready"
+PROBE_PATHS = (HEALTHY_PATH, READY_PATH)
+
+
+def http_response(method: str, path: str, headers):
+    """status, headers and body answering a request, shared by both HTTP servers
+
+    headers is a mapping with lower case header names. /-/healthy and /-/ready
+    are the liveness and readiness probes, every other path gets the exposition.
+    """
+    if method not in ("GET", "HEAD"):
+        return (
+            HTTPStatus.METHOD_NOT_ALLOWED,
+            [("Allow", "GET, HEAD"), ("Content-Length", "0")],
+            b"",
+        )
+    path = path.partition("?")[0]
+    if path == HEALTHY_PATH:
+        return probe_response(method, ingest.progressing(), "Healthy")
+    if path == READY_PATH:
+        return probe_response(method, radios_ready(), "Ready")
+    compress = gzip_accepted(headers.get("accept-encoding"))
+    content_type, body, etag, modified = exposition.get(headers.get("accept"), compress)
+    response_headers = [
+        ("ETag", etag),
+        ("Last-Modified", formatdate(modified, usegmt=True)),
+        ("Vary", "Accept, Accept-Encoding"),
+    ]
+    if not_modified(headers, etag, modified):
+        response_headers.append(("Content-Length", "0"))
+        return HTTPStatus.NOT_MODIFIED, response_headers, b""
+    response_headers.append(("Content-Type", content_type))
+    if compress:
+        response_headers.append(("Content-Encoding", "gzip"))
+    response_headers.append(("Content-Length", str(len(body))))
+    return HTTPStatus.OK, response_headers, body if method == "GET" else b""
+
+
+def probe_response(method: str, ok: bool, what: str):
+    body = f"{what}.\n" if ok else f"Not {what.lower()}.\n"
+    headers = [
+        ("Content-Type", "text/plain; charset=utf-8"),
+        ("Content-Length", str(len(body))),
+    ]
+    status = HTTPStatus.OK if ok else HTTPStatus.SERVICE_UNAVAILABLE
+    return status, headers, body.encode() if method == "GET" else b""
+
+
+class ExpositionHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # idle keep-alive connections give their thread back, like on the asyncio server
+    timeout = 60
+
+    def do_GET(self):
+        self.respond()
+
+    def do_HEAD(self):
+        self.respond()
+
+    def __getattr__(self, name):
+        # other methods get their 405 from http_response, not a 501
+        if name.startswith("do_"):
+            return self.respond
+        raise AttributeError(name)
+
+    def respond(self):
+        # the body is not used, but must not be taken for the next request
+        length = int(self.headers.get("Content-Length", 0))
+        if length:
+            self.rfile.read(length)
+        status, headers, body = http_response(
+            self.command,
+            self.path,
+            {k.lower(): v for k, v in self.headers.items()},
+        )
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+def start_http_server(port: int):
+    server = ThreadingHTTPServer(("", port), ExpositionHandler)
+    server.daemon_threads = True
+    threading.Thread(
+        target=server.serve_forever, name="http-server", daemon=True
+    ).start()
+    return server
+
+
+class AsyncExpositionServer:
+    """Stdlib asyncio HTTP/1.1 server for the exposition.
+
+    Connections are kept alive, idle ones are closed after idle_timeout. At
+    most max_renders requests are answered at the same time, the answers are
+    produced on executor threads so the event loop never renders itself.
+    """
+
+    def __init__(self, port: int, max_renders: int = 2, idle_timeout: float = 60):
+        self.port = port
+        self.max_renders = max_renders
+        self.idle_timeout = idle_timeout
+        self._renders = None
+
+    def start(self):
+        # bound here, so a port in use stops the exporter instead of the thread
+        if socket.has_dualstack_ipv6():
+            listener = socket.create_server(
+                ("", self.port), family=socket.AF_INET6, dualstack_ipv6=True
+            )
+        else:
+            listener = socket.create_server(("", self.port))
+        threading.Thread(
+            target=asyncio.run,
+            args=(self.serve(listener),),
+            name="http-server",
+            daemon=True,
+        ).start()
+
+    async def serve(self, listener: socket.socket):
+        self._renders = asyncio.Semaphore(self.max_renders)
+        server = await asyncio.start_server(self.handle_connection, sock=listener)
+        async with server:
+            await server.serve_forever()
+
+    async def handle_connection(self, reader, writer):
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, path, version, headers = request
+                connection = headers.get("connection", "").lower()
+                keep_alive = (
+                    connection != "close"
+                    if version == "HTTP/1.1"
+                    else connection == "keep-alive"
+                )
+                if path.partition("?")[0] in PROBE_PATHS:
+                    # probes are cheap and must not wait behind renders
+                    status, response_headers, body = http_response(
+                        method, path, headers
+                    )
+                else:
+                    async with self._renders:
+                        status, response_headers, body = await loop.run_in_executor(
+                            None, http_response, method, path, headers
+                        )
+                response_headers.append(
+                    ("Connection", "keep-alive" if keep_alive else "close")
+                )
+                head = f"HTTP/1.1 {status.value} {status.phrase}\r\n" + "".join(
+                    f"{name}: {value}\r\n" for name, value in response_headers
+                )
+                writer.write(head.encode("latin-1") + b"\r\n" + body)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (
+            ConnectionError,
+            TimeoutError,
+            asyncio.IncompleteReadError,
+            ValueError,
+        ) as ex:
+            logger.debug("HTTP connection failed: %s", ex)
+        finally:
+            writer.close()
+
+    async def read_request(self, reader):
+        """returns method, path, version and lower cased headers, None once the client is gone"""
+        try:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+        except TimeoutError:
+            return None
+        if not line:
+            return None
+        method, path, version = line.decode("latin-1").split()
+        headers = {}
+        while True:
+            line = await asyncio.wait_for(reader.readline(), self.idle_timeout)
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", 0))
+        if length:
+            await reader.readexactly(length)
+        return method, path, version, headers
+
+
+class HttpServer(str, Enum):
+    threaded = "threaded"
+    asyncio = "asyncio"
+
+
+http_server = HttpServer.threaded
+http_render_limit = 2
+
+
+def start_exposition_server(port: int):
+    if http_server == HttpServer.asyncio:
+        AsyncExpositionServer(port, http_render_limit).start()
+    else:
+        start_http_server(port)
+
+
 app = typer.Typer()
 
 
-def on_receive(packet, interface):  # pylint: disable=unused-argument
-    """called when a packet arrives"""
-    print(f"Received: {packet}")
-    message_type = packet["decoded"]["portnum"] if "decoded" in packet else "ENCRYPTED"
-    INCOMING_MESSAGES.labels(type=message_type).inc()
-    sending_node = packet["from"]
-    if message_type != "ENCRYPTED" and "rx_time" in packet["decoded"]:
-        set_last_heard(
-            sending_node, nodes[sending_node]["user"], packet["decoded"]["rx_time"]
-        )
-    MESSAGES.labels(
-        src=sending_node,
-        dest=packet["to"] if packet["to"] != BROADCAST_NUM else "all",
-        type=message_type,
-    ).inc()
-    raw_data = packet["raw"]
-    parse_signal_and_hops(raw_data, sending_node)
-    if message_type == "TELEMETRY_APP":
-        parse_telemetry_packet(packet, sending_node)
-    elif message_type == "POSITION_APP":
-        parse_position_packet(packet, sending_node)
-    elif message_type == "NODEINFO_APP":
-        parse_nodeinfo_packet(packet, sending_node)
+class LogLevel(str, Enum):
+    debug = "debug"
+    info = "info"
+    warning = "warning"
+    error = "error"
+    critical = "critical"
+
+
+class PacketFormat(str, Enum):
+    text = "text"
+    json = "json"
+
+
+class PacketLogSampler:
+    """Decides which packets make it to the packet log.
+
+    Logs every n-th packet (0 disables the packet log), additionally capped to
+    at most `rate` packets per second with a token bucket (0 means no cap).
+    """
+
+    def __init__(self, every_n: int = 0, rate: float = 0):
+        self._lock = threading.Lock()
+        self.configure(every_n, rate)
+
+    def configure(self, every_n: int, rate: float):
+        with self._lock:
+            self.every_n = every_n
+            self.rate = rate
+            self._seen = 0
+            self._tokens = rate
+            self._refilled = time.monotonic()
+
+    def should_log(self) -> bool:
+        if not self.every_n:
+            return False
+        with self._lock:
+            self._seen += 1
+            if self._seen % self.every_n:
+                return False
+            if not self.rate:
+                return True
+            now = time.monotonic()
+            self._tokens = min(
+                self.rate, self._tokens + (now - self._refilled) * self.rate
+            )
+            self._refilled = now
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+
+def loggable(value):
+    """copy of a packet without the raw protobufs, with bytes as hex"""
+    if isinstance(value, dict):
+        return {k: loggable(v) for k, v in value.items() if k != "raw"}
+    if isinstance(value, (bytes, bytearray)):
+        return value.hex()
+    if isinstance(value, Message):
+        return MessageToDict(value)
+    return value
+
+
+class JsonPacketFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {"time": record.created, **loggable(record.packet)}
+        return json.dumps(entry, default=str)
+
+
+class TextPacketFormatter(logging.Formatter):
+    def format(self, record):
+        return f"Received: {loggable(record.packet)}"
+
+
+class NonBlockingQueueHandler(logging.handlers.QueueHandler):
+    """Hands records to a listener thread, dropping them when the queue is full.
+
+    Records are not formatted here, the formatting happens on the listener thread.
+    """
+
+    def prepare(self, record):
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            LOG_RECORDS_DROPPED.inc()
+
+
+packet_sampler = PacketLogSampler()
+log_listener: Optional[logging.handlers.QueueListener] = None
+
+
+def configure_logging(
+    level: LogLevel,
+    packet_format: PacketFormat,
+    async_queue_size: int,
+):
+    global log_listener
+    log_handler = logging.StreamHandler(sys.stderr)
+    log_handler.setFormatter(
+        logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s")
+    )
+    packet_handler = logging.StreamHandler(sys.stdout)
+    packet_handler.setFormatter(
+        JsonPacketFormatter()
+        if packet_format == PacketFormat.json
+        else TextPacketFormatter()
+    )
+    if async_queue_size:
+        records = queue.Queue(async_queue_size)
+        log_listener = logging.handlers.QueueListener(
+            records, log_handler, packet_handler, respect_handler_level=True
+        )
+        # each listener handler only takes the records of its own logger
+        log_handler.addFilter(lambda r: r.name != packet_logger.name)
+        packet_handler.addFilter(lambda r: r.name == packet_logger.name)
+        log_handler = packet_handler = NonBlockingQueueHandler(records)
+        log_listener.start()
+        atexit.register(log_listener.stop)
+    logging.basicConfig(level=level.value.upper(), handlers=[log_handler], force=True)
+    packet_logger.handlers = [packet_handler]
+    packet_logger.setLevel(logging.INFO)
+
+
+class DropPolicy(str, Enum):
+    oldest = "oldest"
+    newest = "newest"
+    block = "block"
+
+
+class IngestQueue:
+    """Bounded hand-off between the pubsub callback and the metric updaters.
+
+    The callback only appends to the queue, so the meshtastic threads are never
+    held up by metric updates; worker threads drain the queue in the background.
+    """
+
+    def __init__(self, maxsize: int = 1000, policy: DropPolicy = DropPolicy.oldest):
+        self.maxsize = maxsize
+        self.policy = policy
+        self._items = collections.deque()
+        self._lock = threading.Lock()
+        self._not_empty = threading.Condition(self._lock)
+        self._not_full = threading.Condition(self._lock)
+        self._workers = []
+        # packets queued or being processed, see join
+        self._unfinished = 0
+        self._all_done = threading.Condition(self._lock)
+        # when a worker last took a packet, see progressing
+        self._dequeued = time.monotonic()
+        self.stall_timeout = 60.0
+        INGEST_QUEUE_DEPTH.set_function(self.__len__)
+
+    def __len__(self):
+        return len(self._items)
+
+    def put(self, item):
+        with self._lock:
+            if len(self._items) >= self.maxsize:
+                if self.policy == DropPolicy.newest:
+                    INGEST_DROPPED.labels(policy=self.policy.value).inc()
+                    return
+                if self.policy == DropPolicy.oldest:
+                    self._items.popleft()
+                    self._unfinished -= 1
+                    INGEST_DROPPED.labels(policy=self.policy.value).inc()
+                else:
+                    while len(self._items) >= self.maxsize:
+                        self._not_full.wait()
+            self._items.append(item)
+            self._unfinished += 1
+            self._not_empty.notify()
+        INGEST_ENQUEUED.inc()
+
+    def get(self):
+        with self._lock:
+            while not self._items:
+                self._not_empty.wait()
+            item = self._items.popleft()
+            self._dequeued = time.monotonic()
+            self._not_full.notify()
+            return item
+
+    def start(self, workers: int, target):
+        for i in range(workers):
+            worker = threading.Thread(
+                target=self._drain,
+                args=(target,),
+                name=f"ingest-worker-{i}",
+                daemon=True,
+            )
+            worker.start()
+            self._workers.append(worker)
+
+    def _drain(self, target):
+        while True:
+            packet, interface = self.get()
+            try:
+                target(packet, interface)
+            except Exception:
+                logger.exception(
+                    "Could not process packet %s",
+                    packet.id if isinstance(packet, Message) else packet.get("id"),
+                )
+            finally:
+                with self._lock:
+                    self._unfinished -= 1
+                    if not self._unfinished:
+                        self._all_done.notify_all()
+
+    def progressing(self) -> bool:
+        """the workers run and took a packet within stall_timeout, unless the queue is empty"""
+        with self._lock:
+            stalled = (
+                self._items and time.monotonic() - self._dequeued > self.stall_timeout
+            )
+        return (
+            bool(self._workers)
+            and all(worker.is_alive() for worker in self._workers)
+            and not stalled
+        )
+
+    def join(self):
+        """waits until every queued packet has been processed"""
+        with self._lock:
+            while self._unfinished:
+                self._all_done.wait()
+
+
+ingest = IngestQueue()
+ingest_workers = 1
+
+
+class DedupCache:
+    """Recently seen packet keys, bounded both in size and in time.
+
+    Keys live in a fixed ring of slots, a new key overwrites the oldest slot,
+    and a key is only a duplicate while it was seen less than window seconds ago.
+    Each slot also holds a bit mask of the radios that heard the packet, see merge.
+    Keys are kept for merge_window seconds even when window is 0.
+    """
+
+    def __init__(self, size: int = 4096, window: float = 300, merge_window: float = 2):
+        self.window = window
+        self.merge_window = merge_window
+        self._lock = threading.Lock()
+        self.resize(size)
+
+    def resize(self, size: int):
+        with self._lock:
+            self._keys = [None] * size
+            self._times = [0.0] * size
+            self._radios = [0] * size
+            self._slots = {}
+            self._next = 0
+
+    def seen(self, key, now: float, radio_bit: int = 0) -> bool:
+        """returns True if the key was seen within the window, records it otherwise"""
+        with self._lock:
+            slot = self._slots.get(key)
+            if slot is not None:
+                age = now - self._times[slot]
+                if age <= max(self.window, self.merge_window):
+                    return bool(self.window) and age <= self.window
+                self._times[slot] = now
+                self._radios[slot] = radio_bit
+                return False
+            slot = self._next
+            evicted = self._keys[slot]
+            if evicted is not None:
+                del self._slots[evicted]
+            self._keys[slot] = key
+            self._times[slot] = now
+            self._radios[slot] = radio_bit
+            self._slots[key] = slot
+            self._next = (slot + 1) % len(self._keys)
+            return False
+
+    def merge(self, key, now: float, radio_bit: int) -> bool:
+        """for a copy of a recorded packet, returns True if it is the first copy
+        heard by that radio within merge_window seconds of the first copy, and
+        records the radio"""
+        with self._lock:
+            slot = self._slots.get(key)
+            if (
+                slot is None
+                or now - self._times[slot] > self.merge_window
+                or self._radios[slot] & radio_bit
+            ):
+                return False
+            self._radios[slot] |= radio_bit
+            return True
+
+
+dedup = DedupCache()
+
+JOURNAL_MAGIC = b"MXJ1"
+# MeshPacket length, receive time and node number of the receiving radio,
+# followed by the serialized MeshPacket
+JOURNAL_RECORD = struct.Struct("<IdI")
+# receive time, sending node and offset of the record in the journal
+JOURNAL_INDEX_ENTRY = struct.Struct("<dIQ")
+
+
+class JournalWriter:
+    """Append-only journal of every received MeshPacket.
+
+    Records go to PATH, and for each record a fixed-size entry goes to the
+    PATH.idx index, so readers can find records by time or sending node from
+    the memory-mapped index. write only stamps the receive time and queues the
+    record, in the same order, so the index stays sorted by time. All file I/O
+    happens on a writer thread, which flushes every flush_interval seconds and
+    rotates PATH to PATH.1 once it grows over max_bytes (the oldest journals
+    up to PATH.<backups> are kept), 0 never rotates. Records arriving while
+    queue_size of them wait for the disk are dropped.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_bytes: int = 64 << 20,
+        backups: int = 5,
+        flush_interval: float = 1,
+        queue_size: int = 10000,
+    ):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self._records = queue.Queue(queue_size)
+        self._lock = threading.Lock()
+        self._closed = False
+        # never before the last record, the wall clock can step back
+        self._last_time = 0.0
+        self._open()
+        self._writer = threading.Thread(
+            target=self._write_forever, name="journal-writer", daemon=True
+        )
+        self._writer.start()
+
+    def _open(self):
+        self._journal = open(self.path, "ab", buffering=1 << 20)
+        self._index = open(self.path + ".idx", "ab", buffering=1 << 16)
+        self._offset = self._journal.tell()
+        if not self._offset:
+            self._journal.write(JOURNAL_MAGIC)
+            self._offset = len(JOURNAL_MAGIC)
+
+    def write(self, mesh_packet, radio: int):
+        data = mesh_packet.SerializeToString()
+        with self._lock:
+            if self._closed:
+                return
+            rx_time = max(time.time(), self._last_time)
+            try:
+                self._records.put_nowait(
+                    (data, rx_time, radio, getattr(mesh_packet, "from"))
+                )
+            except queue.Full:
+                JOURNAL_DROPPED.inc()
+                return
+            self._last_time = rx_time
+
+    def _write_forever(self):
+        flushed = time.monotonic()
+        while True:
+            try:
+                record = self._records.get(timeout=self.flush_interval)
+            except queue.Empty:
+                record = ()
+            if record is None:
+                self._close()
+                return
+            if record:
+                self._append(*record)
+            if time.monotonic() - flushed >= self.flush_interval:
+                self._flush()
+                flushed = time.monotonic()
+
+    def _append(self, data: bytes, rx_time: float, radio: int, sender: int):
+        if self.max_bytes and self._offset > self.max_bytes:
+            self._rotate()
+        self._journal.write(JOURNAL_RECORD.pack(len(data), rx_time, radio))
+        self._journal.write(data)
+        self._index.write(JOURNAL_INDEX_ENTRY.pack(rx_time, sender, self._offset))
+        self._offset += JOURNAL_RECORD.size + len(data)
+
+    def _flush(self):
+        # the journal first, so the index never points past its end
+        self._journal.flush()
+        self._index.flush()
+
+    def _rotate(self):
+        self._close()
+        for generation in range(self.backups - 1, 0, -1):
+            for suffix in ("", ".idx"):
+                source = f"{self.path}.{generation}{suffix}"
+                if os.path.exists(source):
+                    os.replace(source, f"{self.path}.{generation + 1}{suffix}")
+        if self.backups:
+            os.replace(self.path, self.path + ".1")
+            os.replace(self.path + ".idx", self.path + ".1.idx")
+        else:
+            os.remove(self.path)
+            os.remove(self.path + ".idx")
+        self._open()
+
+    def _close(self):
+        self._flush()
+        self._journal.close()
+        self._index.close()
 
+    def close(self):
+        """writes out the queued records and closes the journal"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._records.put(None)
+        self._writer.join()
 
+
+journal: Optional[JournalWriter] = None
+
+
+class JournalIndex:
+    """Memory-mapped index of a journal, a sequence of (rx_time, node, offset)."""
+
+    def __init__(self, path: str):
+        with open(path + ".idx", "rb") as file:
+            size = os.fstat(file.fileno()).st_size
+            # a torn entry at the end of an index still being written is ignored
+            self._count = size // JOURNAL_INDEX_ENTRY.size
+            self._map = (
+                mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                if self._count
+                else b""
+            )
+        # node -> offsets of its records, built on the first of_node
+        self._by_node: Optional[dict] = None
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, position: int):
+        if not 0 <= position < self._count:
+            raise IndexError(position)
+        return JOURNAL_INDEX_ENTRY.unpack_from(
+            self._map, position * JOURNAL_INDEX_ENTRY.size
+        )
+
+    def between(self, start: float, end: float) -> List[int]:
+        """offsets of the records received in [start, end)"""
+        first = bisect.bisect_left(self, start, key=lambda entry: entry[0])
+        last = bisect.bisect_left(self, end, first, key=lambda entry: entry[0])
+        return [self[position][2] for position in range(first, last)]
+
+    def of_node(self, num: int) -> List[int]:
+        """offsets of the records sent by a node"""
+        if self._by_node is None:
+            by_node = collections.defaultdict(list)
+            for _, node, offset in JOURNAL_INDEX_ENTRY.iter_unpack(
+                self._map[: self._count * JOURNAL_INDEX_ENTRY.size]
+            ):
+                by_node[node].append(offset)
+            self._by_node = dict(by_node)
+        return list(self._by_node.get(num, ()))
+
+
+def read_journal(path: str, offsets: Optional[List[int]] = None):
+    """yields (rx_time, radio, MeshPacket) of all records, or those at offsets"""
+    with open(path, "rb") as file:
+        if not os.fstat(file.fileno()).st_size:
+            return
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if data[: len(JOURNAL_MAGIC)] != JOURNAL_MAGIC:
+                raise ValueError(f"{path} is not a packet journal")
+            if offsets is None:
+                offsets = journal_offsets(data)
+            for offset in offsets:
+                length, rx_time, radio = JOURNAL_RECORD.unpack_from(data, offset)
+                start = offset + JOURNAL_RECORD.size
+                if start + length > len(data):
+                    # torn record at the end of a journal still being written
+                    return
+                yield (
+                    rx_time,
+                    radio,
+                    mesh_pb2.MeshPacket.FromString(data[start : start + length]),
+                )
+
+
+def journal_offsets(data):
+    offset = len(JOURNAL_MAGIC)
+    while offset + JOURNAL_RECORD.size <= len(data):
+        yield offset
+        offset += JOURNAL_RECORD.size + JOURNAL_RECORD.unpack_from(data, offset)[0]
+
+
+class IngestMode(str, Enum):
+    dict = "dict"
+    protobuf = "protobuf"
+
+
+# read packets from the MeshPacket protobuf instead of the library's dicts
+ingest_protobuf = False
+# count packets no handler needs from their envelope, see install_lazy_decode
+lazy_decode_enabled = True
+
+# packet handlers keyed by portnum, each entry holds the handler with its pre-bound stats.
+# dict handlers get (packet, sending_node) with the packet dict built by the library,
+# protobuf handlers get (payload, sending_node, mesh_packet) with the parsed payload.
+handlers = collections.defaultdict(list)
+protobuf_handlers = collections.defaultdict(list)
+# portnums for which only incoming_messages is counted, everything else is skipped
+disabled_portnums = set()
+PORTNUM_NAMES = {value: name for name, value in portnums_pb2.PortNum.items()}
+
+
+def register_handler(portnum: str, handler, protobuf: bool = False):
+    (protobuf_handlers if protobuf else handlers)[portnum].append(
+        (
+            handler,
+            HANDLER_INVOCATIONS.labels(handler=handler.__name__, type=portnum),
+            HANDLER_SECONDS.labels(handler=handler.__name__, type=portnum),
+            HANDLER_ERRORS.labels(handler=handler.__name__, type=portnum),
+        )
+    )
+
+
+def handles(*portnums: str, protobuf: bool = False):
+    """decorator registering a packet handler for the given portnums"""
+
+    def register(handler):
+        for portnum in portnums:
+            register_handler(portnum, handler, protobuf)
+        return handler
+
+    return register
+
+
+class LatencyReservoir:
+    """uniform sample of at most size durations out of all the added ones
+
+    Keeps replays of long journals in constant memory, while the percentiles
+    of the sample stay close to those of every call.
+    """
+
+    def __init__(self, size: int = 10000):
+        self.size = size
+        self.count = 0
+        self.samples: List[float] = []
+        self._random = random.Random()
+        self._lock = threading.Lock()
+
+    def add(self, seconds: float):
+        with self._lock:
+            self.count += 1
+            if len(self.samples) < self.size:
+                self.samples.append(seconds)
+            else:
+                slot = self._random.randrange(self.count)
+                if slot < self.size:
+                    self.samples[slot] = seconds
+
+
+# handler name -> sample of its call durations, only collected while replaying
+handler_latencies: Optional[collections.defaultdict] = None
+
+
+def dispatch(registered, *args):
+    for handler, invocations, seconds, errors in registered:
+        start = time.perf_counter()
+        try:
+            handler(*args)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - start
+            seconds.inc(elapsed)
+            invocations.inc()
+            if handler_latencies is not None:
+                handler_latencies[handler.__name__].add(elapsed)
+
+
+# interface -> value of the radio label, only filled when several radios are connected.
+# Weak, so interfaces replaced by a reconnect go away once their packets are processed.
+radio_names = weakref.WeakKeyDictionary()
+# radio label -> bit of the radio in DedupCache masks
+radio_bits = {}
+
+
+def on_receive(packet, interface):
+    """called when a packet arrives, hands it over to the ingest workers"""
+    LAST_PACKET_TIMESTAMP.set_to_current_time()
+    watchdog = watchdogs.get(interface) if interface is not None else None
+    if watchdog is not None:
+        watchdog.heard()
+    if journal is not None:
+        my_info = getattr(interface, "myInfo", None)
+        journal.write(
+            packet if isinstance(packet, Message) else packet["raw"],
+            my_info.my_node_num if my_info else 0,
+        )
+    ingest.put((packet, interface))
+
+
+def process_packet(packet, interface):
+    """updates the metrics from a single packet, runs on an ingest worker"""
+    start = time.perf_counter()
+    # the benchmarks and replay process packets without an interface
+    radio = radio_names.get(interface, "") if interface is not None else ""
+    if packet_sampler.should_log():
+        packet_logger.info("packet", extra={"packet": packet})
+    if isinstance(packet, mesh_pb2.MeshPacket):
+        # handed over undecoded by install_lazy_decode
+        message_type = process_mesh_packet(packet, radio=radio)
+    elif ingest_protobuf:
+        message_type = process_mesh_packet(packet["raw"], packet.get("decoded"), radio)
+    else:
+        message_type = (
+            packet["decoded"]["portnum"] if "decoded" in packet else "ENCRYPTED"
+        )
+        sending_node = packet["from"]
+        if count_packet(
+            message_type,
+            sending_node,
+            packet["to"],
+            packet.get("id"),
+            packet.get("rxTime"),
+            radio,
+            packet["raw"],
+        ):
+            parse_signal_and_hops(packet["raw"], sending_node, radio)
+            dispatch(handlers.get(message_type, ()), packet, sending_node)
+    store.changed()
+    PACKET_PROCESSING_SECONDS.labels(type=message_type).observe(
+        time.perf_counter() - start
+    )
+
+
+def process_mesh_packet(mesh_packet, decoded=None, radio=""):
+    """updates the metrics straight from the MeshPacket protobuf, without walking dicts
+
+    When the library has already parsed the payload, its protobuf is taken from
+    the decoded dict instead of being parsed again. Returns the message type.
+    """
+    if mesh_packet.HasField("decoded"):
+        portnum = mesh_packet.decoded.portnum
+        message_type = PORTNUM_NAMES.get(portnum) or str(portnum)
+    else:
+        message_type = "ENCRYPTED"
+    sending_node = getattr(mesh_packet, "from")
+    if count_packet(
+        message_type,
+        sending_node,
+        mesh_packet.to,
+        mesh_packet.id,
+        mesh_packet.rx_time,
+        radio,
+        mesh_packet,
+    ):
+        parse_signal_and_hops(mesh_packet, sending_node, radio)
+        registered = protobuf_handlers.get(message_type)
+        if registered:
+            protocol = protocols[portnum]
+            if decoded is not None and protocol.name in decoded:
+                payload = decoded[protocol.name]["raw"]
+            else:
+                payload = protocol.protobufFactory()
+                payload.ParseFromString(mesh_packet.decoded.payload)
+            dispatch(registered, payload, sending_node, mesh_packet)
+    return message_type
+
+
+def merge_copy(mesh_packet, sending_node, message_type, radio) -> bool:
+    """a copy of an already counted packet, only the signal of a radio that had
+    not heard the packet yet is taken from it, returns whether it was"""
+    if message_type in disabled_portnums or not dedup.merge(
+        (sending_node, mesh_packet.id), time.monotonic(), radio_bits[radio]
+    ):
+        return False
+    MERGED_PACKETS.labels(radio=radio).inc()
+    parse_signal_and_hops(mesh_packet, sending_node, radio)
+    return True
+
+
+def install_lazy_decode(interface: MeshInterface):
+    """Lets packets skip the library's decoding unless a handler needs their payload.
+
+    Those packets go straight from the reader thread to the ingest queue as
+    MeshPacket protobufs and are only counted from their envelope. With
+    --ingest-mode protobuf that is every packet, process_mesh_packet parses
+    the payloads it needs itself. Responses to requests are still left to the
+    library, which may be waiting for them.
+    """
+    needs_payload = (
+        set()
+        if ingest_protobuf
+        else {
+            portnums_pb2.PortNum.Value(name)
+            for name in handlers
+            if name in portnums_pb2.PortNum.keys() and name not in disabled_portnums
+        }
+    )
+    decode = interface._handlePacketFromRadio
+
+    def handle_packet_from_radio(mesh_packet, hack=False):
+        if not mesh_packet.HasField("decoded"):
+            message_type = "ENCRYPTED"
+        else:
+            decoded = mesh_packet.decoded
+            if decoded.portnum in needs_payload or decoded.request_id:
+                return decode(mesh_packet, hack)
+            message_type = PORTNUM_NAMES.get(decoded.portnum) or str(decoded.portnum)
+        if not getattr(mesh_packet, "from"):
+            # the library logs and drops packets the radio echoes back to us
+            return decode(mesh_packet, hack)
+        SKIPPED_DECODES.labels(type=message_type).inc()
+        on_receive(mesh_packet, interface)
+
+    interface._handlePacketFromRadio = handle_packet_from_radio
+
+
+def count_packet(
+    message_type, sending_node, to, packet_id, rx_time, radio="", mesh_packet=None
+) -> bool:
+    """bookkeeping from the packet envelope, returns whether the packet needs further processing
+
+    A copy of a counted packet is either merged, when it is the first copy
+    another radio heard, or counted as a duplicate, never both. Copies are
+    merged even when deduplication is off.
+    """
+    if packet_id and (dedup.window or radio):
+        if radio and merge_copy(mesh_packet, sending_node, message_type, radio):
+            return False
+        if dedup.seen(
+            (sending_node, packet_id), time.monotonic(), radio_bits.get(radio, 0)
+        ):
+            DUPLICATE_PACKETS.labels(type=message_type).inc()
+            return False
+    now = time.time()
+    if rx_time:
+        # a radio clock running ahead of ours would give a negative lag
+        PACKET_LAG_SECONDS.observe(max(0.0, now - rx_time))
+    last_packet = None
+    if store.timestamps and packet_id:
+        last_packet = (packet_id, rx_time or None)
+        INCOMING_MESSAGES.labels(type=message_type).inc(
+            exemplar={"packet_id": str(packet_id)}
+        )
+    else:
+        INCOMING_MESSAGES.labels(type=message_type).inc()
+    if message_type in disabled_portnums:
+        return False
+    node = store.node(sending_node)
+    node.seen = now
+    if message_type != "ENCRYPTED":
+        node.last_heard = rx_time or now
+    store.count_message(
+        sending_node,
+        to if to != BROADCAST_NUM else "all",
+        message_type,
+        last_packet,
+    )
+    return True
+
+
+@handles("NODEINFO_APP")
 def parse_nodeinfo_packet(packet, sending_node):
-    # TODO consider: in case of label renames, should we remove the old instance of this node_info?
-    # if yes, maybe a node_renames counter should be there? definitely a log line.
-    rx_time = packet["rx_time"] if "rx_time" in packet else time.time()
+    rx_time = packet.get("rxTime", time.time())
     set_last_heard(sending_node, packet["decoded"]["user"], rx_time)
     if sending_node not in nodes.keys():
         # we update the internal object with limited info we got in the node
@@ -96,91 +1752,749 @@ def parse_nodeinfo_packet(packet, sending_node):
         }
 
 
-def parse_signal_and_hops(raw_data, sending_node):
+def parse_signal_and_hops(raw_data, sending_node, radio=""):
+    node = store.node(sending_node)
+    rx_time = raw_data.rx_time or None
     if raw_data.hop_start:
-        NODE_HOP_LIMIT.labels(num=sending_node).set(raw_data.hop_start)
+        node.hop_limit = raw_data.hop_start
+        node.hop_limit_time = rx_time
     if raw_data.hop_limit and raw_data.hop_start:
+        signal = node.signal.get(radio)
+        if signal is None:
+            signal = node.signal[radio] = [None, None, None, None, None]
         hops = raw_data.hop_start - raw_data.hop_limit
-        NODE_HOP_COUNT.labels(num=sending_node).set(hops)
+        signal[0] = hops
+        signal[3] = rx_time
         if hops == 0:
             # we have a direct message, SNR and RSSI values (if present) are reliable.
             if raw_data.rx_snr:
-                NODE_SNR.labels(num=sending_node).set(raw_data.rx_snr)
+                signal[1] = raw_data.rx_snr
             if raw_data.rx_rssi:
-                NODE_RSSI.labels(num=sending_node).set(raw_data.rx_rssi)
+                signal[2] = raw_data.rx_rssi
+            signal[4] = rx_time
+
+
+@handles("NODEINFO_APP", protobuf=True)
+def parse_nodeinfo_protobuf(user, sending_node, mesh_packet):
+    rx_time = mesh_packet.rx_time or time.time()
+    set_node_info(sending_node, user_protobuf_labels(user), rx_time)
+    if sending_node not in nodes.keys():
+        nodes[sending_node] = {
+            "num": sending_node,
+            "user": MessageToDict(user),
+            "lastHeard": rx_time,
+        }
 
 
+@handles("POSITION_APP")
 def parse_position_packet(packet, sending_node):
     if "position" in packet["decoded"]:
-        if "latitude" in packet["decoded"]["position"]:
-            NODE_LATITUDE.labels(num=sending_node).set(
-                packet["decoded"]["position"]["latitude"]
-            )
-        if "longitude" in packet["decoded"]["position"]:
-            NODE_LONGITUDE.labels(num=sending_node).set(
-                packet["decoded"]["position"]["longitude"]
-            )
-        if "altitude" in packet["decoded"]["position"]:
-            NODE_ALTITUDE.labels(num=sending_node).set(
-                packet["decoded"]["position"]["altitude"]
-            )
+        position = packet["decoded"]["position"]
+        node = store.node(sending_node)
+        node.position_time = packet.get("rxTime")
+        if "latitude" in position:
+            node.latitude = position["latitude"]
+        if "longitude" in position:
+            node.longitude = position["longitude"]
+        if "altitude" in position:
+            node.altitude = position["altitude"]
+
 
+@handles("POSITION_APP", protobuf=True)
+def parse_position_protobuf(position, sending_node, mesh_packet):  # pylint: disable=unused-argument
+    node = store.node(sending_node)
+    node.position_time = mesh_packet.rx_time or None
+    if position.HasField("latitude_i"):
+        node.latitude = position.latitude_i / 1e7
+    if position.HasField("longitude_i"):
+        node.longitude = position.longitude_i / 1e7
+    if position.HasField("altitude"):
+        node.altitude = position.altitude
 
+
+@handles("TELEMETRY_APP")
 def parse_telemetry_packet(packet, sending_node):
-    if "deviceMetrics" in packet["decoded"]["telemetry"]:
-        for key, value in packet["decoded"]["telemetry"]["deviceMetrics"].items():
-            DEVICE_METRICS.labels(num=sending_node, metric=key, type="device").set(
-                value
-            )
-    if "environmentMetrics" in packet["decoded"]["telemetry"]:
-        for key, value in packet["decoded"]["telemetry"]["environmentMetrics"].items():
-            DEVICE_METRICS.labels(num=sending_node, metric=key, type="environment").set(
-                value
-            )
-    if "localStats" in packet["decoded"]["telemetry"]:
-        for key, value in packet["decoded"]["telemetry"]["localStats"].items():
-            DEVICE_METRICS.labels(num=sending_node, metric=key, type="local").set(value)
+    telemetry = packet["decoded"]["telemetry"]
+    node = store.node(sending_node)
+    values = node.telemetry
+    rx_time = packet.get("rxTime")
+    if "deviceMetrics" in telemetry:
+        for key, value in telemetry["deviceMetrics"].items():
+            values[(key, "device")] = value
+        node.telemetry_times["device"] = rx_time
+    if "environmentMetrics" in telemetry:
+        for key, value in telemetry["environmentMetrics"].items():
+            values[(key, "environment")] = value
+        node.telemetry_times["environment"] = rx_time
+    if "localStats" in telemetry:
+        for key, value in telemetry["localStats"].items():
+            values[(key, "local")] = value
+        node.telemetry_times["local"] = rx_time
+
+
+# telemetry variants exported as device_metric, with the value of their type label
+TELEMETRY_TYPES = {
+    "device_metrics": "device",
+    "environment_metrics": "environment",
+    "local_stats": "local",
+}
+
+
+FLOAT32 = struct.Struct("<f")
+
+
+def shortest_float(value: float) -> float:
+    """the float32 value widened the way MessageToDict does, e.g. 3.2305348 not
+    3.230534791946411"""
+    if not math.isfinite(value):
+        return value
+    # a float32 always round-trips with 9 significant digits
+    for precision in range(6, 10):
+        rounded = float(f"{value:.{precision}g}")
+        try:
+            if FLOAT32.unpack(FLOAT32.pack(rounded))[0] == value:
+                break
+        except OverflowError:
+            # rounded up past the largest float32
+            continue
+    return rounded
+
+
+@handles("TELEMETRY_APP", protobuf=True)
+def parse_telemetry_protobuf(telemetry, sending_node, mesh_packet):  # pylint: disable=unused-argument
+    variant = telemetry.WhichOneof("variant")
+    metric_type = TELEMETRY_TYPES.get(variant)
+    if metric_type is None:
+        return
+    node = store.node(sending_node)
+    values = node.telemetry
+    # json names, so the metric labels match the ones of the dict handler
+    for field, value in getattr(telemetry, variant).ListFields():
+        if field.type == FieldDescriptor.TYPE_FLOAT:
+            value = shortest_float(value)
+        values[(field.json_name, metric_type)] = value
+    node.telemetry_times[metric_type] = mesh_packet.rx_time or None
 
 
 def on_connection(interface, topic=pub.AUTO_TOPIC):  # pylint: disable=unused-argument
     """called when we (re)connect to the radio"""
-    print("radio connected")
+    logger.info("radio connected")
+
+
+def on_connection_lost(interface, topic=pub.AUTO_TOPIC):  # pylint: disable=unused-argument
+    """called by the library when the link to a radio is gone"""
+    for supervisor in supervisors:
+        supervisor.lost(interface)
+
+
+class LivenessWatchdog:
+    """Learns how often a radio delivers packets and notices when it went quiet.
+
+    Packet inter-arrival times feed an exponentially weighted mean and
+    variance. Once the radio is silent for longer than mean + deviations
+    standard deviations (never less than min_silence, and 3 * min_silence
+    until warmup intervals were seen), the radio is asked for its device
+    metadata. The reply is published like any packet and counts as heard. If
+    the request cannot be sent, or still nothing arrives within grace seconds,
+    the radio is considered dead.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        min_silence: float = 300,
+        alpha: float = 0.05,
+        deviations: float = 6,
+        warmup: int = 20,
+        grace: float = 60,
+    ):
+        self.min_silence = min_silence
+        self.alpha = alpha
+        self.deviations = deviations
+        self.warmup = warmup
+        self.grace = grace
+        self.mean = 0.0
+        self.variance = 0.0
+        self.intervals = 0
+        self.last = time.monotonic()
+        self._probed: Optional[float] = None
+        RADIO_SILENCE.labels(radio=name).set_function(
+            lambda: time.monotonic() - self.last
+        )
+        RADIO_EXPECTED_SILENCE.labels(radio=name).set_function(self.expected_silence)
+
+    def reset(self):
+        """starts timing silence afresh, what was learned is kept"""
+        self.last = time.monotonic()
+        self._probed = None
+
+    def heard(self):
+        now = time.monotonic()
+        interval = now - self.last
+        self.last = now
+        if self.intervals:
+            difference = interval - self.mean
+            increment = self.alpha * difference
+            self.mean += increment
+            self.variance = (1 - self.alpha) * (self.variance + difference * increment)
+        else:
+            self.mean = interval
+        self.intervals += 1
+
+    def expected_silence(self) -> float:
+        if self.intervals < self.warmup:
+            return 3 * self.min_silence
+        return max(
+            self.min_silence, self.mean + self.deviations * math.sqrt(self.variance)
+        )
+
+    def alive(self, interface: MeshInterface, name: str) -> bool:
+        now = time.monotonic()
+        silence = now - self.last
+        if silence <= self.expected_silence():
+            self._probed = None
+            return True
+        if self._probed is not None and self.last < self._probed:
+            # nothing arrived since the probe
+            return now - self._probed < self.grace
+        logger.info(
+            "%s silent for %.0fs, expected at most %.0fs, probing it",
+            name,
+            silence,
+            self.expected_silence(),
+        )
+        self._probed = now
+        try:
+            # a heartbeat gets no answer, this request does
+            interface.sendData(
+                admin_pb2.AdminMessage(get_device_metadata_request=True),
+                LOCAL_ADDR,
+                portNum=portnums_pb2.PortNum.ADMIN_APP,
+                wantResponse=True,
+            )
+        except Exception as ex:
+            logger.warning("Probing %s failed: %s", name, ex)
+            return False
+        return True
+
+
+# interface -> watchdog of the radio it belongs to
+watchdogs = weakref.WeakKeyDictionary()
+watchdog_min_silence = 300.0
+
+
+class RadioSupervisor:
+    """Keeps a radio connected, reconnecting with jittered exponential backoff.
+
+    connect opens a MeshInterface, the meshtastic constructors only return once
+    the handshake with the radio is done. The interface is replaced when the
+    library reports the connection lost, when it is no longer connected or when
+    reconnect is called. All metric state lives on across reconnects. Attempts
+    are spaced by a random delay of up to initial_backoff * 2^(failures - 1) seconds,
+    capped at max_backoff; a connection that stayed up longer than max_backoff
+    starts over from initial_backoff.
+    """
+
+    def __init__(self, name: str, connect):
+        self.name = name
+        self.connect = connect
+        # the node database of the radio was loaded at least once
+        self.seeded = False
+        self.initial_backoff = reconnect_initial_backoff
+        self.max_backoff = reconnect_backoff_limit
+        self.interface: Optional[MeshInterface] = None
+        self._lost = threading.Event()
+        self.watchdog = (
+            LivenessWatchdog(name, watchdog_min_silence)
+            if watchdog_min_silence
+            else None
+        )
+        RADIO_UP.labels(radio=name).set(0)
 
+    def start(self):
+        time_handshakes()
+        supervisors.append(self)
+        threading.Thread(
+            target=self.run, name=f"radio {self.name}", daemon=True
+        ).start()
 
-def server_loop(interface: MeshInterface, port: int):
+    def lost(self, interface):
+        if interface is self.interface:
+            self._lost.set()
+
+    def reconnect(self):
+        self._lost.set()
+
+    def run(self):
+        failures = 0
+        connections = 0
+        while True:
+            started = time.monotonic()
+            handshake.config_started = None
+            try:
+                interface = self.connect()
+            except Exception as ex:
+                failures += 1
+                delay = self.backoff(failures)
+                logger.warning(
+                    "Could not connect to %s, retrying in %.1fs: %s",
+                    self.name,
+                    delay,
+                    ex,
+                )
+                time.sleep(delay)
+                continue
+            self._lost.clear()
+            self.interface = interface
+            if store.radio_label:
+                radio_names[interface] = self.name
+            if lazy_decode_enabled:
+                install_lazy_decode(interface)
+            if self.watchdog is not None:
+                self.watchdog.reset()
+                watchdogs[interface] = self.watchdog
+            connected = time.monotonic()
+            # the config download starts when the library asks the radio for it
+            config_started = handshake.config_started or connected
+            seed_nodes(interface)
+            self.seeded = True
+            phases = STARTUP_PHASE_SECONDS
+            phases.labels(self.name, "connect").set(config_started - started)
+            phases.labels(self.name, "config").set(connected - config_started)
+            phases.labels(self.name, "seed").set(time.monotonic() - connected)
+            if connections:
+                RADIO_RECONNECTS.labels(radio=self.name).inc()
+                RADIO_LAST_RECONNECT.labels(radio=self.name).set_to_current_time()
+            connections += 1
+            RADIO_UP.labels(radio=self.name).set(1)
+            connected_at = time.monotonic()
+            while not self._lost.wait(5):
+                if not interface.isConnected.is_set():
+                    break
+                if self.watchdog is not None and not self.watchdog.alive(
+                    interface, self.name
+                ):
+                    break
+            RADIO_UP.labels(radio=self.name).set(0)
+            self.interface = None
+            try:
+                interface.close()
+            except Exception as ex:
+                logger.debug("Error closing %s: %s", self.name, ex)
+            if time.monotonic() - connected_at > self.max_backoff:
+                failures = 0
+            failures += 1
+            delay = self.backoff(failures)
+            logger.warning("Lost %s, reconnecting in %.1fs", self.name, delay)
+            time.sleep(delay)
+
+    def backoff(self, failures: int) -> float:
+        return random.uniform(
+            0, min(self.max_backoff, self.initial_backoff * 2 ** (failures - 1))
+        )
+
+
+supervisors: List[RadioSupervisor] = []
+reconnect_initial_backoff = 1.0
+reconnect_backoff_limit = 300.0
+
+
+def radios_ready() -> bool:
+    """every radio has loaded its node database at least once"""
+    return bool(supervisors) and all(supervisor.seeded for supervisor in supervisors)
+
+
+# the radio handshake running on this thread, see time_handshakes
+handshake = threading.local()
+
+
+def time_handshakes():
+    """has MeshInterface mark where the config download of a handshake starts
+
+    The library connects and downloads the config in one blocking constructor
+    call, this splits it. Only installed once radios are supervised, importing
+    the module leaves the library alone.
+    """
+    start_config = MeshInterface._startConfig
+    if getattr(start_config, "timed", False):
+        return
+
+    @functools.wraps(start_config)
+    def timed_start_config(interface):
+        handshake.config_started = time.monotonic()
+        start_config(interface)
+
+    timed_start_config.timed = True
+    MeshInterface._startConfig = timed_start_config
+
+
+def expire_nodes_forever():
+    """background sweeper removing the nodes whose ttl has passed"""
+    interval = min(60.0, max(1.0, store.ttl / 10))
+    while True:
+        time.sleep(interval)
+        expired = store.expire(time.time())
+        if expired:
+            for num in expired:
+                nodes.pop(num, None)
+            NODES_EXPIRED.inc(len(expired))
+            store.changed()
+            logger.info("Removed %d nodes not heard for %ss", len(expired), store.ttl)
+
+
+def server_loop(radios: List[RadioSupervisor], port: int):
+    if state_snapshot is not None:
+        state_snapshot.load()
+        threading.Thread(
+            target=state_snapshot.save_forever, name="snapshot", daemon=True
+        ).start()
+        atexit.register(state_snapshot.save)
+    # up before any radio is connected, /-/ready tells when the nodes are loaded
+    start_exposition_server(port)
+    ingest.start(ingest_workers, process_packet)
+    if store.ttl:
+        threading.Thread(
+            target=expire_nodes_forever, name="node-expiry", daemon=True
+        ).start()
     pub.subscribe(on_receive, "meshtastic.receive")
     pub.subscribe(on_connection, "meshtastic.connection.established")
-    start_http_server(port)
-    cached_node_info = interface.nodesByNum
+    pub.subscribe(on_connection_lost, "meshtastic.connection.lost")
+    for radio in radios:
+        radio.start()
+    while True:
+        time.sleep(100)
+
+
+def seed_nodes(interface: MeshInterface):
+    """takes over the node database the radio sent during the handshake"""
+    cached_node_info = interface.nodesByNum or {}
     for id, entry in cached_node_info.items():
         nodes[id] = entry
         set_last_heard(
             id, entry["user"], entry["lastHeard"] if "lastHeard" in entry else "0"
         )
-    print(f"Nodes: {nodes}")
-    while True:
-        time.sleep(100)
+    store.changed()
+    logger.info("Loaded %d nodes from the radio", len(cached_node_info))
+    logger.debug("Nodes: %s", nodes)
 
 
 def set_last_heard(num, user, last_heard):
-    NODE_INFO.labels(
-        num=num,
-        id=user["id"],
-        long_name=user["longName"],
-        short_name=user["shortName"],
-        macaddr=user["macaddr"],
-        hw_model=user["hwModel"],
-        is_licensed=user["isLicensed"] if "isLicensed" in user else "False",
-    ).set(last_heard)
+    set_node_info(
+        num,
+        (
+            str(user["id"]),
+            str(user["longName"]),
+            str(user["shortName"]),
+            str(user.get("macaddr", "")),
+            str(user.get("hwModel", "UNSET")),
+            str(user["isLicensed"]) if "isLicensed" in user else "False",
+        ),
+        last_heard,
+    )
+
+
+def user_protobuf_labels(user):
+    """node_info labels from a User protobuf, formatted the way MessageToDict does"""
+    return (
+        user.id,
+        user.long_name,
+        user.short_name,
+        base64.b64encode(user.macaddr).decode(),
+        mesh_pb2.HardwareModel.Name(user.hw_model),
+        str(user.is_licensed),
+    )
+
+
+def set_node_info(num, labels, last_heard):
+    node = store.node(num)
+    if node.user != labels:
+        # node_info is rendered from the current labels only, so replacing
+        # them drops the series with the previous labels
+        if node.user is not None:
+            NODE_RENAMES.inc()
+            logger.info("Node %s changed from %s to %s", num, node.user, labels)
+        node.user = labels
+    node.last_heard = last_heard
+
+
+class SimulatedInterface(MeshInterface):
+    """MeshInterface publishing synthetic mesh traffic instead of talking to a radio.
+
+    nodesByNum is filled up front like after the handshake with a radio, then a
+    background thread builds MeshPackets at rate packets per second (0 is as
+    fast as possible) and hands them to the library's _handlePacketFromRadio,
+    so they are decoded and published on meshtastic.receive like real ones.
+    mix weighs the portnums, duplicates is the share of packets also heard as
+    a flood rebroadcast and renames the share of node infos with a new name.
+    """
+
+    def __init__(
+        self,
+        node_count: int = 100,
+        rate: float = 10,
+        mix: Optional[dict] = None,
+        duplicates: float = 0,
+        renames: float = 0,
+        seed: Optional[int] = None,
+    ):
+        super().__init__(noProto=True)
+        self.rate = rate
+        self.mix = mix or SIMULATED_MIX
+        for portnum in self.mix:
+            # raises ValueError for unknown portnums
+            portnums_pb2.PortNum.Value(portnum)
+        self.duplicates = duplicates
+        self.renames = renames
+        self._random = random.Random(seed)
+        self._packet_id = self._random.randrange(1 << 32)
+        self._names = {}
+        nums = self._random.sample(range(1, BROADCAST_NUM), node_count + 1)
+        self.myInfo = mesh_pb2.MyNodeInfo(my_node_num=nums.pop())
+        self.nums = nums
+        self.nodes = {}
+        self.nodesByNum = {}
+        now = int(time.time())
+        for num in nums:
+            node = {
+                "num": num,
+                "user": MessageToDict(self._user(num)),
+                "lastHeard": now - self._random.randrange(3600),
+            }
+            self.nodesByNum[num] = self.nodes[node["user"]["id"]] = node
+        self.isConnected.set()
+        threading.Thread(target=self._run, name="simulated-radio", daemon=True).start()
+
+    def _sendToRadio(self, toRadio):
+        """there is no radio, everything sent to it is dropped"""
+
+    def close(self):
+        self.isConnected.clear()
+        super().close()
+
+    def _user(self, num, rename=False):
+        generation = self._names.get(num, 0) + rename
+        self._names[num] = generation
+        return mesh_pb2.User(
+            id=f"!{num:08x}",
+            long_name=f"Node {num:08x}" + (f" v{generation}" if generation else ""),
+            short_name=f"{num & 0xFFFF:04x}",
+            hw_model=(9, 43, 50)[num % 3],
+        )
+
+    def _payload(self, portnum, num):
+        if portnum == "NODEINFO_APP":
+            return self._user(num, self._random.random() < self.renames)
+        if portnum == "POSITION_APP":
+            return mesh_pb2.Position(
+                latitude_i=int((52 + self._random.uniform(-1, 1)) * 1e7),
+                longitude_i=int((21 + self._random.uniform(-1, 1)) * 1e7),
+                altitude=self._random.randrange(300),
+            )
+        if portnum == "TELEMETRY_APP":
+            telemetry = telemetry_pb2.Telemetry(time=int(time.time()))
+            if self._random.random() < 0.2:
+                telemetry.environment_metrics.temperature = self._random.uniform(
+                    -10, 30
+                )
+                telemetry.environment_metrics.relative_humidity = self._random.uniform(
+                    20, 90
+                )
+            else:
+                telemetry.device_metrics.battery_level = self._random.randrange(101)
+                telemetry.device_metrics.voltage = self._random.uniform(3.3, 4.2)
+                telemetry.device_metrics.channel_utilization = self._random.uniform(
+                    0, 30
+                )
+                telemetry.device_metrics.air_util_tx = self._random.uniform(0, 5)
+            return telemetry
+        if portnum == "TEXT_MESSAGE_APP":
+            return b"hello"
+        # an empty protobuf of whatever type the portnum carries
+        return b""
+
+    def packet(self):
+        """a random MeshPacket as received by the radio"""
+        num = self._random.choice(self.nums)
+        portnum = self._random.choices(list(self.mix), list(self.mix.values()))[0]
+        payload = self._payload(portnum, num)
+        hop_start = 3
+        self._packet_id = (self._packet_id + 1) & 0xFFFFFFFF
+        mesh_packet = mesh_pb2.MeshPacket(
+            to=BROADCAST_NUM
+            if self._random.random() < 0.9
+            else self._random.choice(self.nums),
+            id=self._packet_id,
+            rx_time=int(time.time()),
+            rx_snr=self._random.uniform(-15, 10),
+            rx_rssi=self._random.randrange(-125, -40),
+            hop_start=hop_start,
+            hop_limit=self._random.randrange(hop_start + 1),
+        )
+        setattr(mesh_packet, "from", num)
+        mesh_packet.decoded.portnum = portnums_pb2.PortNum.Value(portnum)
+        mesh_packet.decoded.payload = (
+            payload if isinstance(payload, bytes) else payload.SerializeToString()
+        )
+        return mesh_packet
+
+    def _run(self):
+        start = time.perf_counter()
+        sent = 0
+        while self.isConnected.is_set():
+            if self.rate:
+                delay = sent / self.rate - (time.perf_counter() - start)
+                if delay > 0:
+                    time.sleep(delay)
+            mesh_packet = self.packet()
+            self._handlePacketFromRadio(mesh_packet)
+            if mesh_packet.hop_limit and self._random.random() < self.duplicates:
+                # the same packet again, rebroadcast by a neighbour
+                copy = mesh_pb2.MeshPacket()
+                copy.CopyFrom(mesh_packet)
+                copy.hop_limit -= 1
+                copy.rx_rssi = self._random.randrange(-125, -40)
+                self._handlePacketFromRadio(copy)
+            sent += 1
+
+
+SIMULATED_MIX = {
+    "TELEMETRY_APP": 4,
+    "POSITION_APP": 2,
+    "NODEINFO_APP": 1,
+    "TEXT_MESSAGE_APP": 1,
+    "ROUTING_APP": 1,
+}
+
+
+@app.callback()
+def main(
+    queue_size: Annotated[int, typer.Option(min=1)] = 1000,
+    drop_policy: DropPolicy = DropPolicy.oldest,
+    workers: Annotated[int, typer.Option(min=1)] = 1,
+    disable_portnum: Optional[List[str]] = None,
+    log_level: Annotated[LogLevel, typer.Option(case_sensitive=False)] = LogLevel.info,
+    packet_log_every: int = 0,
+    packet_log_rate: float = 0,
+    packet_log_format: PacketFormat = PacketFormat.text,
+    log_queue_size: int = 0,
+    exposition_max_age: float = 60,
+    node_ttl: float = 0,
+    message_top_k: Annotated[int, typer.Option(min=0)] = 0,
+    dedup_window: float = 300,
+    dedup_size: Annotated[int, typer.Option(min=1)] = 4096,
+    merge_window: float = 2,
+    reconnect_backoff: float = 1,
+    reconnect_max_backoff: float = 300,
+    watchdog_silence: float = 300,
+    ingest_mode: IngestMode = IngestMode.dict,
+    lazy_decode: bool = True,
+    http: HttpServer = HttpServer.threaded,
+    http_max_renders: Annotated[int, typer.Option(min=1)] = 2,
+    openmetrics: bool = False,
+    snapshot: Optional[str] = None,
+    snapshot_interval: float = 60,
+    record: Optional[str] = None,
+    record_max_bytes: int = 64 << 20,
+    record_backups: int = 5,
+):
+    """Export metrics of a Meshtastic mesh to Prometheus.
+
+    The packet log is off by default, --packet-log-every N logs every N-th
+    packet and --packet-log-rate caps it to that many packets per second.
+    A non-zero --log-queue-size writes all logs from a background thread,
+    dropping records when that many are already waiting.
+
+    Scrapes are served from the last rendered exposition until a packet
+    arrives or the rendered body is older than --exposition-max-age seconds.
+
+    With --node-ttl, all series of a node not heard for that many seconds
+    are removed.
+
+    With --message-top-k, message_count only has series for the K busiest
+    src/dest pairs, all other messages are counted with src and dest "other".
+
+    Copies of a packet (same sender and id) arriving within --dedup-window
+    seconds are only counted in duplicate_packets, 0 disables de-duplication.
+    --dedup-size bounds how many recent packets are remembered. With several
+    radios, the first copy each radio hears within --merge-window seconds
+    updates that radio's signal series without being counted again.
+
+    A radio that is lost is reconnected after a random delay of up to
+    --reconnect-backoff seconds, doubled for every failed attempt up to
+    --reconnect-max-backoff. A radio is also reconnected when it stays silent
+    for much longer than usual, at least --watchdog-silence seconds, and
+    does not answer a metadata request; 0 turns this watchdog off.
+
+    --ingest-mode protobuf reads packets from the MeshPacket protobuf instead
+    of the dicts built by the meshtastic library, which then decodes only
+    responses to requests. Otherwise packets of portnums without a handler are
+    not decoded at all. --no-lazy-decode has the library decode every packet.
+
+    --http asyncio serves the exposition from an asyncio server answering at
+    most --http-max-renders requests at the same time.
+
+    --openmetrics always serves OpenMetrics, with per-node samples stamped
+    with the radio receive time and message counters carrying the packet id
+    as exemplar.
+
+    With --snapshot PATH, the node state and message counters are written to
+    PATH every --snapshot-interval seconds and on exit, and loaded from it on
+    startup so a restart does not lose them.
+
+    --record PATH appends every received packet to a journal at PATH with an
+    index at PATH.idx, rotated once it is larger than --record-max-bytes with
+    --record-backups older journals kept.
+    """
+    global ingest_workers, ingest_protobuf, lazy_decode_enabled
+    global http_server, http_render_limit, state_snapshot, journal
+    global reconnect_initial_backoff, reconnect_backoff_limit, watchdog_min_silence
+    configure_logging(log_level, packet_log_format, log_queue_size)
+    packet_sampler.configure(packet_log_every, packet_log_rate)
+    exposition.max_age = exposition_max_age
+    store.ttl = node_ttl
+    if message_top_k:
+        store.top_messages = TopMessagePairs(message_top_k)
+    dedup.window = dedup_window
+    dedup.merge_window = merge_window
+    reconnect_initial_backoff = reconnect_backoff
+    reconnect_backoff_limit = reconnect_max_backoff
+    watchdog_min_silence = watchdog_silence
+    dedup.resize(dedup_size)
+    ingest.maxsize = queue_size
+    ingest.policy = drop_policy
+    ingest_workers = workers
+    ingest_protobuf = ingest_mode == IngestMode.protobuf
+    lazy_decode_enabled = lazy_decode
+    http_server = http
+    http_render_limit = http_max_renders
+    exposition.openmetrics = store.timestamps = openmetrics
+    disabled_portnums.update(disable_portnum or [])
+    if snapshot:
+        state_snapshot = Snapshot(snapshot, snapshot_interval)
+    if record:
+        journal = JournalWriter(record, record_max_bytes, record_backups)
+        atexit.register(journal.close)
+    # docker stop, systemd and Kubernetes stop the exporter with SIGTERM,
+    # which ends the process without running the atexit hooks
+    signal.signal(signal.SIGTERM, exit_on_signal)
+
+
+def exit_on_signal(signum, frame):  # pylint: disable=unused-argument
+    """exits like on ctrl-c, so the final snapshot and journal flush happen"""
+    sys.exit(0)
 
 
 @app.command()
 def tcp(host: str = "meshtastic.local", port: int = 8000):
-    try:
-        server_loop(meshtastic.tcp_interface.TCPInterface(hostname=host), port)
-    except Exception as ex:
-        print(f"Error: Could not connect to {host} {ex}")
-        sys.exit(1)
+    server_loop(
+        [
+            RadioSupervisor(
+                f"tcp://{host}",
+                lambda: meshtastic.tcp_interface.TCPInterface(hostname=host),
+            )
+        ],
+        port,
+    )
 
 
 @app.command()
@@ -192,33 +2506,172 @@ def ble(address: Optional[str] = "any", port: int = 8000, discover: bool = False
         print(f"Potential devices: {potential_devices}")
         sys.exit(0)
     if address == "any":
-        potential_devices = meshtastic.ble_interface.BLEClient().discover()
-        for device in potential_devices:
-            try:
-                server_loop(
-                    meshtastic.ble_interface.BLEInterface(address=device.address), port
-                )
-            except Exception as ex:
-                print(
-                    f"Could not connect to {device.address}, likely not a Meshtastic device. Exception: {ex}"
-                )
-                continue
-        print("Error: No Meshtastic-compatible devices found. Exiting.")
-        sys.exit(1)
-    try:
-        server_loop(meshtastic.ble_interface.BLEInterface(address=address), port)
-    except Exception as ex:
-        print(f"Error: Could not connect to {address} {ex}")
-        sys.exit(1)
+        connect = connect_any_ble
+    else:
+        connect = functools.partial(
+            meshtastic.ble_interface.BLEInterface, address=address
+        )
+    server_loop([RadioSupervisor(f"ble://{address}", connect)], port)
+
+
+def connect_any_ble() -> MeshInterface:
+    """connects to the first discovered bluetooth device that is a Meshtastic radio"""
+    potential_devices = meshtastic.ble_interface.BLEClient().discover()
+    for device in potential_devices:
+        try:
+            return meshtastic.ble_interface.BLEInterface(address=device.address)
+        except Exception as ex:
+            logger.warning(
+                "Could not connect to %s, likely not a Meshtastic device. Exception: %s",
+                device.address,
+                ex,
+            )
+    raise ConnectionError("No Meshtastic-compatible devices found")
 
 
 @app.command()
 def serial(path: Optional[str] = None, port: int = 8000):
-    try:
-        server_loop(meshtastic.serial_interface.SerialInterface(devPath=path), port)
-    except Exception as ex:
-        print(f"Error: Could not connect to serial {ex}")
-        sys.exit(1)
+    server_loop(
+        [
+            RadioSupervisor(
+                f"serial://{path or ''}",
+                lambda: meshtastic.serial_interface.SerialInterface(devPath=path),
+            )
+        ],
+        port,
+    )
+
+
+def open_radio(spec: str) -> MeshInterface:
+    """connects to a radio given as tcp://host[:port], serial://[device] or ble://[address]"""
+    scheme, _, target = spec.partition("://")
+    if scheme == "tcp":
+        host, _, tcp_port = target.partition(":")
+        return meshtastic.tcp_interface.TCPInterface(
+            hostname=host,
+            portNumber=int(tcp_port or meshtastic.tcp_interface.DEFAULT_TCP_PORT),
+        )
+    if scheme == "serial":
+        return meshtastic.serial_interface.SerialInterface(devPath=target or None)
+    if scheme == "ble":
+        return meshtastic.ble_interface.BLEInterface(address=target or None)
+    raise ValueError(f"expected tcp://, serial:// or ble://, got {spec}")
+
+
+@app.command()
+def radios(specs: List[str], port: int = 8000):
+    """Reads from several radios, e.g. tcp://host serial:///dev/ttyACM0 ble://address.
+
+    All radios share the node state, their signal series get a radio label
+    with the spec of the radio that heard the node.
+    """
+    store.radio_label = True
+    supervised = []
+    for spec in specs:
+        radio_bits[spec] = 1 << len(radio_bits)
+        supervised.append(RadioSupervisor(spec, functools.partial(open_radio, spec)))
+    server_loop(supervised, port)
+
+
+@app.command()
+def simulate(
+    nodes: int = 100,
+    rate: float = 10,
+    mix: Optional[List[str]] = None,
+    duplicates: float = 0.1,
+    renames: float = 0.01,
+    seed: Optional[int] = None,
+    port: int = 8000,
+):
+    """Runs the exporter against a simulated mesh instead of a radio.
+
+    --mix PORTNUM=WEIGHT can be given several times to choose the portnums,
+    --rate 0 sends packets as fast as they are consumed.
+    """
+    weights = None
+    if mix:
+        weights = {}
+        for entry in mix:
+            portnum, _, weight = entry.partition("=")
+            weights[portnum] = float(weight or 1)
+    server_loop(
+        [
+            RadioSupervisor(
+                "simulated",
+                lambda: SimulatedInterface(
+                    nodes, rate, weights, duplicates, renames, seed
+                ),
+            )
+        ],
+        port,
+    )
+
+
+@app.command()
+def replay(journals: List[str], speed: float = 0):
+    """Feeds recorded journals through the ingest pipeline, oldest first.
+
+    Packets are replayed as fast as possible, or with --speed at that multiple
+    of the speed they were received at. Throughput, handler latencies and peak
+    memory are reported at the end, and a --snapshot of the resulting state is
+    written.
+    """
+    global handler_latencies
+    import resource  # pylint: disable=import-outside-toplevel
+
+    interface = MeshInterface(noProto=True)
+    interface.nodes = {}
+    interface.nodesByNum = {}
+    handler_latencies = collections.defaultdict(LatencyReservoir)
+    if not speed:
+        # measure the pipeline, not the drop policy
+        ingest.policy = DropPolicy.block
+    ingest.start(ingest_workers, process_packet)
+    if lazy_decode_enabled:
+        install_lazy_decode(interface)
+    pub.subscribe(on_receive, "meshtastic.receive")
+    published = meshtastic.publishingThread.queue
+    count = 0
+    first_rx_time = None
+    start = time.perf_counter()
+    for path in journals:
+        for rx_time, _, mesh_packet in read_journal(path):
+            if speed:
+                if first_rx_time is None:
+                    first_rx_time = rx_time
+                delay = (rx_time - first_rx_time) / speed - (
+                    time.perf_counter() - start
+                )
+                if delay > 0:
+                    time.sleep(delay)
+            # keep the library's unbounded publishing queue from running ahead
+            while published.qsize() > ingest.maxsize:
+                time.sleep(0.001)
+            interface._handlePacketFromRadio(mesh_packet)
+            count += 1
+    done = threading.Event()
+    meshtastic.publishingThread.queueWork(done.set)
+    done.wait()
+    ingest.join()
+    elapsed = time.perf_counter() - start
+    store.changed()
+
+    print(
+        f"Replayed {count} packets in {elapsed:.2f}s, {count / elapsed:.0f} packets/s"
+    )
+    for name, latencies in sorted(handler_latencies.items()):
+        if len(latencies.samples) < 2:
+            continue
+        percentiles = statistics.quantiles(latencies.samples, n=100)
+        print(
+            f"{name}: {latencies.count} calls, p50 {percentiles[49] * 1e6:.1f}us "
+            f"p90 {percentiles[89] * 1e6:.1f}us p99 {percentiles[98] * 1e6:.1f}us"
+        )
+    # kilobytes on Linux
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(f"Peak RSS {peak_rss / 1024:.1f} MiB")
+    if state_snapshot is not None:
+        state_snapshot.save()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,42 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+class DedupCacheTest(unittest.TestCase):
+    def test_window(self):
+        dedup = exporter.DedupCache(size=8, window=10)
+        self.assertFalse(dedup.seen((1, 1), 0))
+        self.assertTrue(dedup.seen((1, 1), 5))
+        self.assertFalse(dedup.seen((1, 1), 20))
+        self.assertTrue(dedup.seen((1, 1), 25))
+
+    def test_ring_eviction(self):
+        dedup = exporter.DedupCache(size=3, window=10)
+        for packet_id in range(4):
+            self.assertFalse(dedup.seen((1, packet_id), 0))
+        self.assertEqual(len(dedup._slots), 3)
+        # the oldest key made room for the fourth
+        self.assertFalse(dedup.seen((1, 0), 1))
+        self.assertTrue(dedup.seen((1, 3), 1))
+
+    def test_resize_forgets(self):
+        dedup = exporter.DedupCache(size=3, window=10)
+        dedup.seen((1, 1), 0)
+        dedup.resize(1)
+        self.assertFalse(dedup.seen((1, 1), 1))
+        self.assertFalse(dedup.seen((1, 2), 1))
+        self.assertFalse(dedup.seen((1, 1), 1))
+
+    def test_same_id_from_another_sender_is_not_a_duplicate(self):
+        dedup = exporter.DedupCache(size=8, window=10)
+        self.assertFalse(dedup.seen((1, 7), 0))
+        self.assertFalse(dedup.seen((2, 7), 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
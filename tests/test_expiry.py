@@ -0,0 +1,58 @@
+import os
+import sys
+import time
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+class ExpiryTest(unittest.TestCase):
+    def setUp(self):
+        for name in ("store", "dedup"):
+            self.addCleanup(setattr, exporter, name, getattr(exporter, name))
+        exporter.store = exporter.NodeStore()
+        exporter.store.ttl = 100
+        exporter.dedup = exporter.DedupCache(window=0)
+
+    def count(self, sending_node, message_type, packet_id):
+        return exporter.count_packet(
+            message_type, sending_node, exporter.BROADCAST_NUM, packet_id, None
+        )
+
+    def test_node_not_heard_for_ttl_is_removed(self):
+        now = time.time()
+        self.count(1, "TEXT_MESSAGE_APP", 1)
+        self.count(2, "TEXT_MESSAGE_APP", 2)
+        exporter.store.nodes[2].seen = now + 50
+        self.assertEqual(exporter.store.expire(now + 99), [])
+        self.assertEqual(exporter.store.expire(now + 101), [1])
+        self.assertEqual(exporter.store.expire(now + 151), [2])
+        self.assertEqual(exporter.store.nodes, {})
+
+    def test_encrypted_packets_keep_a_node(self):
+        now = time.time()
+        self.count(1, "ENCRYPTED", 1)
+        node = exporter.store.nodes[1]
+        self.assertIsNone(node.last_heard)
+        node.seen = now + 90
+        self.assertEqual(exporter.store.expire(now + 101), [])
+        self.assertIn(1, exporter.store.nodes)
+        self.assertEqual(exporter.store.expire(now + 191), [1])
+
+    def test_expired_node_drops_its_message_counts(self):
+        now = time.time()
+        self.count(1, "TEXT_MESSAGE_APP", 1)
+        self.count(2, "TEXT_MESSAGE_APP", 2)
+        exporter.store.count_message(2, 1, "TEXT_MESSAGE_APP")
+        exporter.store.nodes[2].seen = now + 200
+        self.assertEqual(exporter.store.expire(now + 101), [1])
+        # the direct message to the expired node goes with it
+        self.assertEqual(
+            list(exporter.store.nodes[2].sent), [("all", "TEXT_MESSAGE_APP")]
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
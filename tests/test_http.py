@@ -0,0 +1,121 @@
+import http.client
+import os
+import socket
+import sys
+import time
+import unittest
+from email.utils import formatdate
+from http import HTTPStatus
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class HttpResponseTest(unittest.TestCase):
+    def get(self, headers=None, method="GET", path="/metrics"):
+        status, response_headers, body = exporter.http_response(
+            method, path, headers or {}
+        )
+        return status, dict(response_headers), body
+
+    def test_get_has_validators(self):
+        status, headers, body = self.get()
+        self.assertEqual(status, HTTPStatus.OK)
+        self.assertIn("ETag", headers)
+        self.assertIn("Last-Modified", headers)
+        self.assertEqual(int(headers["Content-Length"]), len(body))
+
+    def test_head_has_the_headers_of_get_without_body(self):
+        _, get_headers, body = self.get()
+        status, headers, head_body = self.get(method="HEAD")
+        self.assertEqual(status, HTTPStatus.OK)
+        self.assertEqual(head_body, b"")
+        self.assertEqual(headers["Content-Length"], str(len(body)))
+        self.assertEqual(headers["ETag"], get_headers["ETag"])
+
+    def test_if_none_match(self):
+        _, headers, _ = self.get()
+        status, _, body = self.get({"if-none-match": headers["ETag"]})
+        self.assertEqual((status, body), (HTTPStatus.NOT_MODIFIED, b""))
+        status, _, _ = self.get({"if-none-match": '"stale"'})
+        self.assertEqual(status, HTTPStatus.OK)
+
+    def test_if_modified_since(self):
+        _, headers, _ = self.get()
+        status, _, _ = self.get({"if-modified-since": headers["Last-Modified"]})
+        self.assertEqual(status, HTTPStatus.NOT_MODIFIED)
+        long_ago = formatdate(time.time() - 3600, usegmt=True)
+        status, _, _ = self.get({"if-modified-since": long_ago})
+        self.assertEqual(status, HTTPStatus.OK)
+
+    def test_if_none_match_wins_over_if_modified_since(self):
+        _, headers, _ = self.get()
+        status, _, _ = self.get(
+            {
+                "if-none-match": '"stale"',
+                "if-modified-since": headers["Last-Modified"],
+            }
+        )
+        self.assertEqual(status, HTTPStatus.OK)
+
+    def test_other_methods_are_not_allowed(self):
+        status, headers, _ = self.get(method="POST")
+        self.assertEqual(status, HTTPStatus.METHOD_NOT_ALLOWED)
+        self.assertEqual(headers["Allow"], "GET, HEAD")
+
+    def test_probes(self):
+        status, _, body = self.get(path="/-/ready?verbose")
+        self.assertEqual(
+            (status, body), (HTTPStatus.SERVICE_UNAVAILABLE, b"Not ready.\n")
+        )
+
+
+class ServersTest(unittest.TestCase):
+    def request(self, port, method, path="/metrics", headers=None):
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=5)
+        try:
+            connection.request(method, path, headers=headers or {})
+            response = connection.getresponse()
+            return response.status, dict(response.getheaders()), response.read()
+        finally:
+            connection.close()
+
+    def check_server(self, port):
+        status, headers, body = self.request(port, "GET")
+        self.assertEqual(status, 200)
+        self.assertEqual(int(headers["Content-Length"]), len(body))
+        status, _, body = self.request(port, "HEAD")
+        self.assertEqual((status, body), (200, b""))
+        status, _, _ = self.request(
+            port, "GET", headers={"If-None-Match": headers["ETag"]}
+        )
+        self.assertEqual(status, 304)
+        status, headers, _ = self.request(port, "DELETE")
+        self.assertEqual((status, headers["Allow"]), (405, "GET, HEAD"))
+
+    def test_threaded(self):
+        port = free_port()
+        server = exporter.start_http_server(port)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.check_server(port)
+
+    def test_asyncio(self):
+        port = free_port()
+        exporter.AsyncExpositionServer(port).start()
+        self.check_server(port)
+
+    def test_asyncio_port_in_use(self):
+        with socket.create_server(("", 0)) as taken, self.assertRaises(OSError):
+            exporter.AsyncExpositionServer(taken.getsockname()[1]).start()
+
+
+if __name__ == "__main__":
+    unittest.main()
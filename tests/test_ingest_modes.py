@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+import unittest
+
+import meshtastic
+from meshtastic.mesh_interface import MeshInterface
+from meshtastic.protobuf import mesh_pb2, portnums_pb2, telemetry_pb2
+from prometheus_client import CollectorRegistry, generate_latest
+from pubsub import pub
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+def mesh_packet(sender, packet_id, portnum, payload):
+    packet = mesh_pb2.MeshPacket(
+        id=packet_id, to=exporter.BROADCAST_NUM, rx_time=1_700_000_000 + packet_id
+    )
+    setattr(packet, "from", sender)
+    packet.hop_start, packet.hop_limit = 3, 1
+    packet.rx_snr, packet.rx_rssi = 6.25, -90
+    packet.decoded.portnum = portnum
+    packet.decoded.payload = payload.SerializeToString()
+    return packet
+
+
+def traffic():
+    telemetry = telemetry_pb2.Telemetry(time=1_700_000_000)
+    telemetry.device_metrics.battery_level = 87
+    telemetry.device_metrics.voltage = 3.2305348
+    telemetry.device_metrics.channel_utilization = 12.345678
+    environment = telemetry_pb2.Telemetry(time=1_700_000_000)
+    environment.environment_metrics.temperature = -3.1
+    environment.environment_metrics.relative_humidity = 55.5
+    position = mesh_pb2.Position(
+        latitude_i=523456789, longitude_i=-210987654, altitude=120
+    )
+    user = mesh_pb2.User(
+        id="!0000002a", long_name="Node ż", short_name="2a", hw_model=9
+    )
+    app = portnums_pb2.PortNum
+    return [
+        mesh_packet(42, 1, app.TELEMETRY_APP, telemetry),
+        mesh_packet(42, 2, app.TELEMETRY_APP, environment),
+        mesh_packet(42, 3, app.POSITION_APP, position),
+        mesh_packet(42, 4, app.NODEINFO_APP, user),
+        mesh_packet(43, 5, app.TEXT_MESSAGE_APP, mesh_pb2.Data()),
+    ]
+
+
+def library_dicts(packets):
+    """the packet dicts the meshtastic library publishes for packets"""
+    received = []
+
+    def on_receive(packet, interface):  # pylint: disable=unused-argument
+        received.append(packet)
+
+    interface = MeshInterface(noProto=True)
+    interface.nodes, interface.nodesByNum = {}, {}
+    pub.subscribe(on_receive, "meshtastic.receive")
+    try:
+        for packet in packets:
+            interface._handlePacketFromRadio(packet)
+        done = threading.Event()
+        meshtastic.publishingThread.queueWork(done.set)
+        done.wait()
+    finally:
+        pub.unsubscribe(on_receive, "meshtastic.receive")
+    return received
+
+
+class IngestModesTest(unittest.TestCase):
+    def setUp(self):
+        for name in ("store", "nodes", "dedup", "ingest_protobuf"):
+            self.addCleanup(setattr, exporter, name, getattr(exporter, name))
+
+    def render(self, packets, protobuf):
+        exporter.store = exporter.NodeStore()
+        exporter.nodes = {}
+        exporter.dedup = exporter.DedupCache(window=0)
+        exporter.ingest_protobuf = protobuf
+        for packet in packets:
+            exporter.process_packet(packet, None)
+        registry = CollectorRegistry()
+        registry.register(exporter.NodeCollector(exporter.store))
+        return generate_latest(registry).decode()
+
+    def test_modes_export_the_same_series(self):
+        packets = traffic()
+        from_dicts = self.render(library_dicts(packets), protobuf=False)
+        from_protobuf = self.render(packets, protobuf=True)
+        self.assertIn(
+            'device_metric{metric="voltage",num="42",type="device"} 3.2305348',
+            from_dicts,
+        )
+        self.assertEqual(from_protobuf, from_dicts)
+
+    def test_nan_telemetry_does_not_hang(self):
+        telemetry = telemetry_pb2.Telemetry()
+        telemetry.device_metrics.voltage = float("nan")
+        packet = mesh_packet(42, 1, portnums_pb2.PortNum.TELEMETRY_APP, telemetry)
+        worker = threading.Thread(
+            target=self.render, args=([packet], True), daemon=True
+        )
+        worker.start()
+        worker.join(5)
+        self.assertFalse(worker.is_alive())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,103 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from meshtastic.protobuf import mesh_pb2
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+def mesh_packet(sender, packet_id):
+    packet = mesh_pb2.MeshPacket(id=packet_id, to=exporter.BROADCAST_NUM)
+    setattr(packet, "from", sender)
+    return packet
+
+
+class JournalTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.directory = directory.name
+        self.path = os.path.join(directory.name, "packets.journal")
+
+    def test_round_trip(self):
+        writer = exporter.JournalWriter(self.path, max_bytes=0)
+        written = [mesh_packet(packet_id % 3 + 1, packet_id) for packet_id in range(30)]
+        for packet in written:
+            writer.write(packet, 42)
+        writer.close()
+
+        index = exporter.JournalIndex(self.path)
+        self.assertEqual(len(index), len(written))
+        records = list(exporter.read_journal(self.path))
+        self.assertEqual([packet for _, _, packet in records], written)
+        self.assertEqual({radio for _, radio, _ in records}, {42})
+
+        times = [index[position][0] for position in range(len(index))]
+        middle = times[10]
+        between = exporter.read_journal(self.path, index.between(middle, times[20]))
+        self.assertEqual([packet.id for _, _, packet in between], list(range(10, 20)))
+
+        of_node = exporter.read_journal(self.path, index.of_node(2))
+        self.assertEqual([packet.id for _, _, packet in of_node], list(range(1, 30, 3)))
+        self.assertEqual(index.of_node(99), [])
+
+    def test_index_is_sorted_with_concurrent_writers(self):
+        writer = exporter.JournalWriter(self.path, max_bytes=0)
+
+        def write(radio):
+            for packet_id in range(500):
+                writer.write(mesh_packet(radio, packet_id), radio)
+
+        threads = [threading.Thread(target=write, args=(radio,)) for radio in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        writer.close()
+        index = exporter.JournalIndex(self.path)
+        times = [index[position][0] for position in range(len(index))]
+        self.assertEqual(len(times), 2000)
+        self.assertEqual(times, sorted(times))
+
+    def test_flushed_on_a_quiet_mesh(self):
+        writer = exporter.JournalWriter(self.path, max_bytes=0, flush_interval=0.1)
+        self.addCleanup(writer.close)
+        writer.write(mesh_packet(1, 1), 0)
+        time.sleep(0.5)
+        self.assertEqual(len(exporter.JournalIndex(self.path)), 1)
+        self.assertEqual(
+            [packet.id for _, _, packet in exporter.read_journal(self.path)], [1]
+        )
+
+    def test_rotation_keeps_backups(self):
+        writer = exporter.JournalWriter(self.path, max_bytes=2000, backups=2)
+        for packet_id in range(600):
+            writer.write(mesh_packet(1, packet_id), 0)
+        writer.close()
+        self.assertEqual(
+            sorted(os.listdir(self.directory)),
+            [
+                "packets.journal",
+                "packets.journal.1",
+                "packets.journal.1.idx",
+                "packets.journal.2",
+                "packets.journal.2.idx",
+                "packets.journal.idx",
+            ],
+        )
+        ids = []
+        for path in (self.path + ".2", self.path + ".1", self.path):
+            records = list(exporter.read_journal(path))
+            self.assertEqual(len(exporter.JournalIndex(path)), len(records))
+            ids += [packet.id for _, _, packet in records]
+        self.assertEqual(ids, list(range(ids[0], 600)))
+
+
+if __name__ == "__main__":
+    unittest.main()
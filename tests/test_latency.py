@@ -0,0 +1,49 @@
+import collections
+import os
+import statistics
+import sys
+import unittest
+
+from prometheus_client import Counter
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+class LatencyReservoirTest(unittest.TestCase):
+    def test_keeps_every_duration_until_full(self):
+        reservoir = exporter.LatencyReservoir(size=10)
+        for seconds in range(5):
+            reservoir.add(seconds)
+        self.assertEqual((reservoir.count, reservoir.samples), (5, [0, 1, 2, 3, 4]))
+
+    def test_bounded_and_representative(self):
+        reservoir = exporter.LatencyReservoir(size=1000)
+        for seconds in range(100_000):
+            reservoir.add(seconds)
+        self.assertEqual(reservoir.count, 100_000)
+        self.assertEqual(len(reservoir.samples), 1000)
+        median = statistics.median(reservoir.samples)
+        self.assertLess(abs(median - 50_000), 10_000)
+
+    def test_dispatch_records_into_the_reservoir(self):
+        self.addCleanup(setattr, exporter, "handler_latencies", None)
+        exporter.handler_latencies = collections.defaultdict(
+            lambda: exporter.LatencyReservoir(size=3)
+        )
+        calls = []
+
+        def on_thing(value):
+            calls.append(value)
+
+        counter = Counter("test_dispatch_calls", "calls", registry=None)
+        for value in range(5):
+            exporter.dispatch([(on_thing, counter, counter, counter)], value)
+        self.assertEqual(calls, [0, 1, 2, 3, 4])
+        reservoir = exporter.handler_latencies["on_thing"]
+        self.assertEqual((reservoir.count, len(reservoir.samples)), (5, 3))
+
+
+if __name__ == "__main__":
+    unittest.main()
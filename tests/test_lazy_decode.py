@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from meshtastic.mesh_interface import MeshInterface
+from meshtastic.protobuf import mesh_pb2, portnums_pb2
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+app = portnums_pb2.PortNum
+
+
+def mesh_packet(portnum=None, sender=42, request_id=0):
+    packet = mesh_pb2.MeshPacket(id=1, to=exporter.BROADCAST_NUM)
+    setattr(packet, "from", sender)
+    if portnum is None:
+        packet.encrypted = b"\x00" * 8
+    else:
+        packet.decoded.portnum = portnum
+        packet.decoded.request_id = request_id
+    return packet
+
+
+class LazyDecodeTest(unittest.TestCase):
+    def setUp(self):
+        for name in ("ingest_protobuf", "disabled_portnums"):
+            self.addCleanup(setattr, exporter, name, getattr(exporter, name))
+        exporter.ingest_protobuf = False
+        exporter.disabled_portnums = set()
+        self.decoded = []
+        self.received = []
+        patcher = mock.patch.object(
+            exporter,
+            "on_receive",
+            side_effect=lambda packet, interface: self.received.append(packet),
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def install(self):
+        interface = MeshInterface(noProto=True)
+        interface._handlePacketFromRadio = lambda packet, hack=False: (
+            self.decoded.append(packet)
+        )
+        exporter.install_lazy_decode(interface)
+        return interface
+
+    def skipped(self, message_type):
+        return (
+            REGISTRY.get_sample_value("skipped_decodes_total", {"type": message_type})
+            or 0
+        )
+
+    def test_portnums_without_handlers_skip_decoding(self):
+        interface = self.install()
+        before = self.skipped("TEXT_MESSAGE_APP")
+        text = mesh_packet(app.TEXT_MESSAGE_APP)
+        telemetry = mesh_packet(app.TELEMETRY_APP)
+        interface._handlePacketFromRadio(text)
+        interface._handlePacketFromRadio(telemetry)
+        self.assertEqual(self.received, [text])
+        self.assertEqual(self.decoded, [telemetry])
+        self.assertEqual(self.skipped("TEXT_MESSAGE_APP"), before + 1)
+
+    def test_encrypted_packets_skip_decoding(self):
+        interface = self.install()
+        before = self.skipped("ENCRYPTED")
+        encrypted = mesh_packet()
+        interface._handlePacketFromRadio(encrypted)
+        self.assertEqual((self.received, self.decoded), ([encrypted], []))
+        self.assertEqual(self.skipped("ENCRYPTED"), before + 1)
+
+    def test_responses_and_echoes_go_to_the_library(self):
+        interface = self.install()
+        response = mesh_packet(app.ADMIN_APP, request_id=7)
+        echo = mesh_packet(app.TEXT_MESSAGE_APP, sender=0)
+        interface._handlePacketFromRadio(response)
+        interface._handlePacketFromRadio(echo)
+        self.assertEqual((self.received, self.decoded), ([], [response, echo]))
+
+    def test_disabled_portnums_skip_decoding(self):
+        exporter.disabled_portnums = {"TELEMETRY_APP"}
+        interface = self.install()
+        telemetry = mesh_packet(app.TELEMETRY_APP)
+        interface._handlePacketFromRadio(telemetry)
+        self.assertEqual((self.received, self.decoded), ([telemetry], []))
+
+    def test_protobuf_mode_decodes_nothing(self):
+        exporter.ingest_protobuf = True
+        interface = self.install()
+        packets = [mesh_packet(app.TELEMETRY_APP), mesh_packet(app.POSITION_APP)]
+        for packet in packets:
+            interface._handlePacketFromRadio(packet)
+        self.assertEqual((self.received, self.decoded), (packets, []))
+
+
+if __name__ == "__main__":
+    unittest.main()
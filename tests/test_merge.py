@@ -0,0 +1,81 @@
+import os
+import sys
+import unittest
+from unittest import mock
+
+from meshtastic.protobuf import mesh_pb2
+from prometheus_client import REGISTRY
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+def mesh_packet(sender, packet_id):
+    packet = mesh_pb2.MeshPacket(id=packet_id, to=exporter.BROADCAST_NUM)
+    setattr(packet, "from", sender)
+    packet.rx_snr, packet.rx_rssi = 6.25, -90
+    return packet
+
+
+class MergeTest(unittest.TestCase):
+    def setUp(self):
+        for name in ("store", "dedup", "radio_bits"):
+            self.addCleanup(setattr, exporter, name, getattr(exporter, name))
+        exporter.store = exporter.NodeStore()
+        exporter.radio_bits = {"a": 1, "b": 2}
+        self.clock = 1000.0
+        patcher = mock.patch.object(
+            exporter.time, "monotonic", side_effect=lambda: self.clock
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def count(self, radio, packet_id=1):
+        return exporter.count_packet(
+            "TEXT_MESSAGE_APP",
+            7,
+            exporter.BROADCAST_NUM,
+            packet_id,
+            None,
+            radio,
+            mesh_packet(7, packet_id),
+        )
+
+    def counts(self):
+        def sample(name, **labels):
+            return REGISTRY.get_sample_value(name, labels) or 0
+
+        return (
+            sample("incoming_messages_total", type="TEXT_MESSAGE_APP"),
+            sample("merged_packets_total", radio="a")
+            + sample("merged_packets_total", radio="b"),
+            sample("duplicate_packets_total", type="TEXT_MESSAGE_APP"),
+        )
+
+    def check(self, window, expected):
+        """counts five copies of a packet, returns whether each was counted"""
+        exporter.dedup = exporter.DedupCache(size=8, window=window, merge_window=2)
+        before = self.counts()
+        results = []
+        for radio, at in (("a", 0), ("b", 1), ("a", 1.5), ("b", 1.5), ("b", 5)):
+            self.clock = 1000.0 + at
+            results.append(self.count(radio))
+        changes = tuple(after - start for after, start in zip(self.counts(), before))
+        self.assertEqual(changes, expected)
+        return results
+
+    def test_copies_from_other_radios_are_merged(self):
+        # counted once, merged once, the rest are duplicates
+        results = self.check(300, (1, 1, 3))
+        self.assertEqual(results, [True, False, False, False, False])
+
+    def test_merged_with_dedup_off(self):
+        # the copy from b within the merge window is not counted again,
+        # repeats are counted since they are not deduplicated
+        results = self.check(0, (4, 1, 0))
+        self.assertEqual(results, [True, False, True, True, True])
+
+
+if __name__ == "__main__":
+    unittest.main()
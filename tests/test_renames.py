@@ -0,0 +1,66 @@
+import os
+import sys
+import unittest
+
+from prometheus_client import REGISTRY, CollectorRegistry, generate_latest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+def user(long_name, hw_model="HELTEC_V3"):
+    return {
+        "id": "!0000002a",
+        "longName": long_name,
+        "shortName": "2a",
+        "hwModel": hw_model,
+    }
+
+
+class RenamesTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, exporter, "store", exporter.store)
+        exporter.store = exporter.NodeStore()
+
+    def renames(self):
+        return REGISTRY.get_sample_value("node_renames_total") or 0
+
+    def node_info(self):
+        registry = CollectorRegistry()
+        registry.register(exporter.NodeCollector(exporter.store))
+        return [
+            line
+            for line in generate_latest(registry).decode().splitlines()
+            if line.startswith("node_info{")
+        ]
+
+    def test_rename_replaces_the_node_info_series(self):
+        before = self.renames()
+        exporter.set_last_heard(42, user("Old name"), 1_700_000_000)
+        exporter.set_last_heard(42, user("Old name"), 1_700_000_060)
+        self.assertEqual(self.renames(), before)
+        exporter.set_last_heard(42, user("New name"), 1_700_000_120)
+        self.assertEqual(self.renames(), before + 1)
+        series = self.node_info()
+        self.assertEqual(len(series), 1)
+        self.assertIn('long_name="New name"', series[0])
+        self.assertEqual(exporter.store.nodes[42].last_heard, 1_700_000_120)
+
+    def test_other_labels_count_as_renames(self):
+        exporter.set_last_heard(42, user("Node", "TBEAM"), 1_700_000_000)
+        before = self.renames()
+        exporter.set_last_heard(42, user("Node", "RAK4631"), 1_700_000_060)
+        self.assertEqual(self.renames(), before + 1)
+        self.assertIn('hw_model="RAK4631"', self.node_info()[0])
+
+    def test_first_node_info_is_not_a_rename(self):
+        before = self.renames()
+        exporter.set_last_heard(42, user("Node"), 1_700_000_000)
+        exporter.set_last_heard(43, user("Node"), 1_700_000_000)
+        self.assertEqual(self.renames(), before)
+        self.assertEqual(len(self.node_info()), 2)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import marshal
+import os
+import sys
+import tempfile
+import unittest
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, "state.snapshot")
+        self.addCleanup(setattr, exporter, "store", exporter.store)
+        exporter.store = self.new_store()
+
+    def new_store(self):
+        store = exporter.NodeStore()
+        store.top_messages = exporter.TopMessagePairs(5)
+        return store
+
+    def fill(self):
+        for num in range(1, 20):
+            node = exporter.store.node(num)
+            node.last_heard = 1_700_000_000 + num
+            node.latitude, node.longitude = 52 + num / 100, 21.0
+            node.telemetry[("batteryLevel", "device")] = num
+            for _ in range(num):
+                exporter.store.count_message(num, "all", "TEXT_MESSAGE_APP")
+                exporter.store.count_message(num, num + 1, "TEXT_MESSAGE_APP")
+
+    def test_round_trip(self):
+        self.fill()
+        dumped = exporter.store.dump()
+        exporter.Snapshot(self.path).save()
+        exporter.store = self.new_store()
+        self.assertTrue(exporter.Snapshot(self.path).load())
+        self.assertEqual(exporter.store.dump(), dumped)
+
+    def test_missing_and_unknown_files_are_ignored(self):
+        self.assertFalse(exporter.Snapshot(self.path).load())
+        with open(self.path, "wb") as file:
+            file.write(b"something else")
+        self.assertFalse(exporter.Snapshot(self.path).load())
+        with open(self.path, "wb") as file:
+            file.write(exporter.Snapshot.MAGIC + b"not zlib")
+        self.assertFalse(exporter.Snapshot(self.path).load())
+        self.assertEqual(exporter.store.nodes, {})
+
+    def test_fields_of_other_versions(self):
+        """fields a snapshot lacks keep their defaults, unknown ones are skipped"""
+        state = {
+            "fields": ("num", "last_heard", "from_the_future"),
+            "nodes": [(1, 1_700_000_000, "?")],
+        }
+        with open(self.path, "wb") as file:
+            file.write(
+                exporter.Snapshot.MAGIC
+                + zlib.compress(marshal.dumps((marshal.dumps(state), {})))
+            )
+        self.assertTrue(exporter.Snapshot(self.path).load())
+        node = exporter.store.nodes[1]
+        self.assertEqual(node.last_heard, 1_700_000_000)
+        self.assertIsNone(node.seen)
+        self.assertEqual(node.signal, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
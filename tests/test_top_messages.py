@@ -0,0 +1,82 @@
+import collections
+import os
+import random
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+def counted(top):
+    """messages per type over all tracked pairs and the "other" bucket"""
+    totals = collections.Counter(top.other)
+    for _, counts, _ in top.pairs.values():
+        totals.update(counts)
+    return totals
+
+
+class TopMessagePairsTest(unittest.TestCase):
+    def test_total_stays_exact(self):
+        top = exporter.TopMessagePairs(10)
+        rng = random.Random(1)
+        sent = collections.Counter()
+        for _ in range(5000):
+            message_type = rng.choice(("TEXT_MESSAGE_APP", "TELEMETRY_APP"))
+            top.count(rng.randrange(100), rng.randrange(3), message_type)
+            sent[message_type] += 1
+        self.assertEqual(counted(top), sent)
+
+    def test_int_and_broadcast_dests_with_equal_estimates(self):
+        top = exporter.TopMessagePairs(5)
+        rng = random.Random(2)
+        for _ in range(5000):
+            dest = rng.choice((1, 2, "all"))
+            top.count(rng.randrange(20), dest, "TEXT_MESSAGE_APP")
+        self.assertEqual(counted(top)["TEXT_MESSAGE_APP"], 5000)
+        restored = exporter.TopMessagePairs(3)
+        restored.restore(top.pairs, top.other)
+        self.assertEqual(counted(restored), counted(top))
+
+    def test_memory_is_bounded_by_k(self):
+        top = exporter.TopMessagePairs(10)
+        for src in range(1000):
+            top.count(src, "all", "TEXT_MESSAGE_APP")
+            self.assertLessEqual(len(top.pairs), 10)
+            # one heap entry per tracked pair
+            self.assertEqual(len(top._heap), len(top.pairs))
+
+    def test_heavy_hitter_is_kept(self):
+        top = exporter.TopMessagePairs(5)
+        busy = 0xBEEF
+        for src in range(1000):
+            top.count(src, "all", "TEXT_MESSAGE_APP")
+            top.count(busy, "all", "TEXT_MESSAGE_APP")
+        estimate, counts, _ = top.pairs[(busy, "all")]
+        self.assertGreaterEqual(estimate, 1000)
+        self.assertLessEqual(counts["TEXT_MESSAGE_APP"], 1000)
+
+    def test_restore_evicts_down_to_k(self):
+        large = exporter.TopMessagePairs(50)
+        for src in range(200):
+            for _ in range(src % 7 + 1):
+                large.count(src, "all", "TEXT_MESSAGE_APP")
+        small = exporter.TopMessagePairs(10)
+        small.restore(large.pairs, large.other)
+        self.assertEqual(len(small.pairs), 10)
+        self.assertEqual(counted(small), counted(large))
+
+    def test_removed_node_is_not_evicted_again(self):
+        top = exporter.TopMessagePairs(3)
+        for src in range(3):
+            top.count(src, "all", "TEXT_MESSAGE_APP")
+        top.remove_node(0)
+        for src in range(3, 10):
+            top.count(src, 1, "TEXT_MESSAGE_APP")
+        self.assertEqual(len(top.pairs), 3)
+        self.assertEqual(counted(top)["TEXT_MESSAGE_APP"], 9)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,87 @@
+import math
+import os
+import sys
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import meshtastic_exporter as exporter
+
+
+class LivenessWatchdogTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = 1000.0
+        patcher = mock.patch.object(
+            exporter.time, "monotonic", side_effect=lambda: self.clock
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.watchdog = exporter.LivenessWatchdog(
+            "test", min_silence=10, alpha=0.5, deviations=2, warmup=3, grace=5
+        )
+        self.interface = mock.Mock()
+
+    def hear(self, *intervals):
+        for interval in intervals:
+            self.clock += interval
+            self.watchdog.heard()
+
+    def alive(self, after):
+        self.clock += after
+        return self.watchdog.alive(self.interface, "test")
+
+    def test_ewma_of_intervals(self):
+        self.hear(4, 8, 2)
+        # mean 4 -> 6 -> 4, variance 0 -> 4 -> 6
+        self.assertEqual((self.watchdog.mean, self.watchdog.variance), (4, 6))
+        self.assertEqual(self.watchdog.intervals, 3)
+
+    def test_expected_silence(self):
+        self.hear(4, 8)
+        self.assertEqual(self.watchdog.expected_silence(), 30)
+        self.hear(2)
+        self.assertEqual(self.watchdog.expected_silence(), 10)
+        self.hear(100)
+        self.assertAlmostEqual(
+            self.watchdog.expected_silence(),
+            self.watchdog.mean + 2 * math.sqrt(self.watchdog.variance),
+        )
+        self.assertGreater(self.watchdog.expected_silence(), 10)
+
+    def test_probes_then_gives_up_after_grace(self):
+        self.hear(1, 1, 1)
+        self.assertTrue(self.alive(9))
+        self.interface.sendData.assert_not_called()
+        self.assertTrue(self.alive(2))
+        self.interface.sendData.assert_called_once()
+        self.assertTrue(self.alive(4))
+        self.assertFalse(self.alive(2))
+        self.interface.sendData.assert_called_once()
+
+    def test_reply_to_the_probe_keeps_it_alive(self):
+        self.hear(1, 1, 1)
+        self.assertTrue(self.alive(11))
+        self.hear(1)
+        self.assertTrue(self.alive(6))
+        self.assertEqual(self.interface.sendData.call_count, 1)
+        # silent again, probed again
+        self.assertTrue(self.alive(20))
+        self.assertEqual(self.interface.sendData.call_count, 2)
+
+    def test_failed_probe(self):
+        self.interface.sendData.side_effect = OSError("gone")
+        self.hear(1, 1, 1)
+        with self.assertLogs(exporter.logger, "WARNING"):
+            self.assertFalse(self.alive(11))
+
+    def test_reset_keeps_what_was_learned(self):
+        self.hear(4, 8, 2)
+        self.watchdog.reset()
+        self.assertEqual(self.watchdog.mean, 4)
+        self.assertTrue(self.alive(10))
+        self.interface.sendData.assert_not_called()
+
+
+if __name__ == "__main__":
+    unittest.main()